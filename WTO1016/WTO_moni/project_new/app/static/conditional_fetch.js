@@ -0,0 +1,37 @@
+// 轮询接口的条件请求：带上次的 ETag 发送 If-None-Match，
+// 服务端返回 304 时直接复用上一次解析好的数据，不再下载和解析 JSON
+
+const etagCache = new Map();  // url -> { etag, data }
+
+// 服务端时钟偏移（毫秒，服务器时间 - 本地时间）：响应带 X-Server-Time（秒）时更新，304 也带，
+// 页面用它把服务端下发的绝对时间戳（如计时器 deadline）换算为本地时间
+let serverClockOffset = 0;
+
+function syncServerClock(serverTime) {
+    if (serverTime) {
+        serverClockOffset = serverTime * 1000 - Date.now();
+    }
+}
+
+async function fetchJSONCached(url, options = {}) {
+    const cached = etagCache.get(url);
+    const headers = Object.assign({}, options.headers || {});
+    if (cached) {
+        headers['If-None-Match'] = cached.etag;
+    }
+
+    const response = await fetch(url, Object.assign({}, options, { headers }));
+    syncServerClock(Number(response.headers.get('X-Server-Time')));
+    if (response.status === 304 && cached) {
+        return cached.data;
+    }
+
+    const data = await response.json();
+    const etag = response.headers.get('ETag');
+    if (response.ok && etag) {
+        etagCache.set(url, { etag, data });
+    } else {
+        etagCache.delete(url);
+    }
+    return data;
+}
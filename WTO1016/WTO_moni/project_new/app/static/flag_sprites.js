@@ -0,0 +1,11 @@
+// 国旗雪碧图：页面注入 window.FLAG_SPRITES = {文件名: [雪碧图序号, CSS类名]}，
+// 未构建雪碧图或清单中没有该国旗时，回退为单独的 <img>
+
+function flagHTML(flagUrl, className, alt) {
+    const filename = (flagUrl || '').split('/').pop();
+    const sprite = window.FLAG_SPRITES && window.FLAG_SPRITES[filename];
+    if (sprite) {
+        return `<span class="${className} flag-sprite flag-sheet-${sprite[0]} ${sprite[1]}" role="img" aria-label="${alt}" title="${alt}"></span>`;
+    }
+    return `<img class="${className}" src="${flagUrl}" alt="${alt}" onerror="this.src='/static/flags/default.png'">`;
+}
@@ -0,0 +1,21 @@
+// 在线状态心跳：服务端在 session_joined / room_status 中下发 heartbeat_interval（秒），
+// 页面按此间隔发送 presence_heartbeat；连接因超时被移出在线列表时（presence_expired）调用 rejoin 重新加入
+
+function keepPresenceAlive(socket, rejoin) {
+    let timer = null;
+
+    function start(data) {
+        clearInterval(timer);
+        if (!data || !data.heartbeat_interval) return;
+        timer = setInterval(() => {
+            if (socket.connected) socket.emit('presence_heartbeat');
+        }, data.heartbeat_interval * 1000);
+    }
+
+    socket.on('session_joined', start);
+    socket.on('room_status', start);
+    socket.on('disconnect', () => clearInterval(timer));
+    socket.on('presence_expired', () => {
+        if (rejoin) rejoin();
+    });
+}
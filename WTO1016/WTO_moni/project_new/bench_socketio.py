@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WTO会议系统 Socket.IO 并发压测脚本
+
+运行方法：
+python bench_socketio.py                                   # 1000 个连接，对 http://127.0.0.1:5000 压测
+python bench_socketio.py --clients 2000 --votes 50         # 更多连接和投票广播
+python bench_socketio.py --url http://10.0.0.5:5000 --session-id bench01
+
+模拟与会国页面：每个客户端以 WebSocket 连接并通过 join_session 订阅同一会期，
+然后由脚本逐票调用 /api/cast_file_vote，统计 vote_status_changed 推送到全部客户端的延迟。
+输出建立连接耗时、订阅失败数、每票的推送到达率以及延迟的 p50 / p95 / 最大值。
+
+注意：
+- 压测会向 --session-id 指定的会期写入投票（默认 benchmark，落在主库），不要对正式会期运行
+- 客户端使用 eventlet 协程，单个压测进程即可维持上千个连接；需要 ulimit -n 大于连接数
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import statistics
+import sys
+import time
+
+import requests
+import socketio
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+class BenchClient:
+    def __init__(self, url, session_id, received):
+        self.sio = socketio.Client(reconnection=False)
+        self.joined = eventlet.event.Event()
+        self.url = url
+        self.session_id = session_id
+
+        @self.sio.on("session_joined")
+        def on_joined(data):
+            if not self.joined.ready():
+                self.joined.send(True)
+
+        @self.sio.on("vote_status_changed")
+        def on_vote(data):
+            # 服务端会把合并窗口内的多张票合成一条推送，按 deltas 逐票计时
+            now = time.perf_counter()
+            for delta in data.get("deltas", []):
+                received.setdefault(delta.get("file_id"), []).append(now)
+
+    def connect(self, timeout):
+        self.sio.connect(self.url, transports=["websocket"], wait_timeout=timeout)
+        self.sio.emit("join_session", {"session_id": self.session_id})
+        with eventlet.Timeout(timeout):
+            self.joined.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket.IO 会期广播压测")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="服务地址")
+    parser.add_argument("--clients", type=int, default=1000, help="并发连接数，默认 1000")
+    parser.add_argument("--votes", type=int, default=20, help="广播的投票数，默认 20")
+    parser.add_argument("--session-id", default="benchmark", help="压测使用的会期编号")
+    parser.add_argument("--connect-concurrency", type=int, default=100, help="同时建立连接的数量")
+    parser.add_argument("--timeout", type=float, default=30, help="单个连接/单票等待超时（秒）")
+    args = parser.parse_args()
+
+    received = {}
+    clients = [BenchClient(args.url, args.session_id, received) for _ in range(args.clients)]
+
+    # 1. 建立连接并订阅会期
+    failures = 0
+    started = time.perf_counter()
+    pool = eventlet.GreenPool(args.connect_concurrency)
+
+    def connect(client):
+        try:
+            client.connect(args.timeout)
+            return True
+        except Exception:
+            return False
+
+    for ok in pool.imap(connect, clients):
+        failures += 0 if ok else 1
+    connect_seconds = time.perf_counter() - started
+    connected = args.clients - failures
+    print(f"[连接] {connected}/{args.clients} 个客户端已订阅，用时 {connect_seconds:.1f}s，失败 {failures}")
+    if not connected:
+        return 1
+
+    # 2. 逐票广播，统计推送到达全部客户端的延迟
+    latencies = []
+    incomplete = 0
+    for i in range(args.votes):
+        file_id = f"bench-file-{i}"
+        sent = time.perf_counter()
+        requests.post(f"{args.url}/api/cast_file_vote", json={
+            "session_id": args.session_id,
+            "country_id": "bench-country",
+            "file_id": file_id,
+            "vote_result": "agree",
+        }, timeout=args.timeout).raise_for_status()
+
+        deadline = sent + args.timeout
+        while len(received.get(file_id, [])) < connected and time.perf_counter() < deadline:
+            eventlet.sleep(0.01)
+        arrivals = received.get(file_id, [])
+        if len(arrivals) < connected:
+            incomplete += 1
+        latencies.extend((t - sent) * 1000 for t in arrivals)
+        print(f"[投票 {i + 1}/{args.votes}] 送达 {len(arrivals)}/{connected}，"
+              f"最慢 {(max(arrivals) - sent) * 1000 if arrivals else 0:.0f}ms")
+
+    print("=" * 50)
+    print(f"连接数：{connected}  投票：{args.votes}  未全部送达：{incomplete}")
+    print(f"推送延迟 p50={statistics.median(latencies) if latencies else 0:.0f}ms  "
+          f"p95={percentile(latencies, 95):.0f}ms  max={max(latencies) if latencies else 0:.0f}ms")
+
+    for client in clients:
+        if client.sio.connected:
+            client.sio.disconnect()
+    return 0 if not failures and not incomplete else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WTO会议系统国旗雪碧图构建脚本
+
+运行方法：
+python build_flag_sprites.py                 # 生成 app/static/sprites/ 下的雪碧图和清单
+python build_flag_sprites.py --cell 64x48    # 指定单元格尺寸（默认 64x48，即 32x24 显示的两倍）
+
+把 app/static/flags/*.png 缩放裁剪为统一的 4:3 单元格，拼成一张（国旗过多时分成几张）雪碧图，
+并输出：
+- flags.json  清单：每个国旗文件所在的雪碧图、CSS 类名和像素偏移
+- flags.css   样式：.flag-sprite 与 .flag-<代码> 类，背景位置使用百分比，适配任意 4:3 显示尺寸
+页面在清单中找不到的国旗继续使用单独的 <img>。新增或替换国旗后重新运行本脚本。
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import re
+import sys
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+BASE_DIR = Path(__file__).resolve().parent
+FLAG_DIR = BASE_DIR / "app" / "static" / "flags"
+SPRITE_DIR = BASE_DIR / "app" / "static" / "sprites"
+SPRITE_URL = "/static/sprites"
+
+def css_class_for(filename):
+    """国旗文件名 -> CSS 类名，如 cn.png -> flag-cn，"bi (1).png" -> flag-bi-1"""
+    stem = Path(filename).stem.lower()
+    return "flag-" + re.sub(r"[^a-z0-9]+", "-", stem).strip("-")
+
+def fit_cell(image, width, height):
+    """按 object-fit: cover 的方式居中裁剪并缩放到单元格大小"""
+    image = image.convert("RGBA")
+    src_w, src_h = image.size
+    scale = max(width / src_w, height / src_h)
+    resized = image.resize((max(width, round(src_w * scale)), max(height, round(src_h * scale))), Image.LANCZOS)
+    left = (resized.width - width) // 2
+    top = (resized.height - height) // 2
+    return resized.crop((left, top, left + width, top + height))
+
+def build(cell_w, cell_h, columns, per_sheet):
+    flags = sorted(p for p in FLAG_DIR.glob("*.png"))
+    if not flags:
+        print(f"[FAIL] {FLAG_DIR} 中没有国旗文件")
+        return 1
+
+    SPRITE_DIR.mkdir(parents=True, exist_ok=True)
+    for old in SPRITE_DIR.glob("flags-*.png"):
+        old.unlink()
+
+    manifest = {"cell": [cell_w, cell_h], "sheets": [], "flags": {}}
+    css = [
+        "/* 由 build_flag_sprites.py 生成，请勿手工修改 */",
+        ".flag-sprite { display: inline-block; background-repeat: no-repeat; }",
+    ]
+    used_classes = set()
+
+    for sheet_index, start in enumerate(range(0, len(flags), per_sheet)):
+        batch = flags[start:start + per_sheet]
+        cols = min(columns, len(batch))
+        rows = math.ceil(len(batch) / cols)
+        sheet = Image.new("RGBA", (cols * cell_w, rows * cell_h), (0, 0, 0, 0))
+
+        positions = []
+        for i, path in enumerate(batch):
+            col, row = i % cols, i // cols
+            with Image.open(path) as img:
+                sheet.paste(fit_cell(img, cell_w, cell_h), (col * cell_w, row * cell_h))
+            positions.append((path.name, col, row))
+
+        data = sheet_bytes(sheet)
+        digest = hashlib.sha256(data).hexdigest()[:10]
+        sheet_name = f"flags-{sheet_index}.{digest}.png"
+        (SPRITE_DIR / sheet_name).write_bytes(data)
+        manifest["sheets"].append({"file": sheet_name, "columns": cols, "rows": rows})
+
+        css.append(
+            f".flag-sheet-{sheet_index} {{ background-image: url({SPRITE_URL}/{sheet_name}); "
+            f"background-size: {cols * 100}% {rows * 100}%; }}"
+        )
+        for name, col, row in positions:
+            css_class = css_class_for(name)
+            if css_class in used_classes:
+                css_class = f"{css_class}-{sheet_index}-{col}-{row}"
+            used_classes.add(css_class)
+            x = col / (cols - 1) * 100 if cols > 1 else 0
+            y = row / (rows - 1) * 100 if rows > 1 else 0
+            manifest["flags"][name] = {
+                "sheet": sheet_index,
+                "class": css_class,
+                "x": col * cell_w,
+                "y": row * cell_h,
+            }
+            css.append(f".{css_class} {{ background-position: {x:.4f}% {y:.4f}%; }}")
+
+        print(f"[OK] {sheet_name}: {len(batch)} 面国旗，{cols}x{rows}，{len(data) // 1024} KB")
+
+    (SPRITE_DIR / "flags.json").write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+    (SPRITE_DIR / "flags.css").write_text("\n".join(css) + "\n", encoding="utf-8")
+    print(f"[OK] 清单已写入 {SPRITE_DIR / 'flags.json'} 和 flags.css")
+    return 0
+
+def sheet_bytes(sheet):
+    buffer = BytesIO()
+    sheet.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description="把国旗打包成雪碧图并生成 JSON/CSS 清单")
+    parser.add_argument("--cell", default="64x48", help="单元格尺寸，宽x高，默认 64x48")
+    parser.add_argument("--columns", type=int, default=16, help="每行国旗数，默认 16")
+    parser.add_argument("--per-sheet", type=int, default=256, help="每张雪碧图最多国旗数，默认 256")
+    args = parser.parse_args()
+
+    try:
+        cell_w, cell_h = (int(v) for v in args.cell.lower().split("x"))
+    except ValueError:
+        print("[FAIL] --cell 格式应为 宽x高，例如 64x48")
+        return 1
+    return build(cell_w, cell_h, args.columns, args.per_sheet)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WTO会议系统静态资源构建脚本
+
+运行方法：
+python build_static_assets.py            # 生成 app/static/dist/ 及 manifest.json
+python build_static_assets.py --clean    # 只删除 app/static/dist/
+
+把 app/static 下的样式、脚本、国旗和雪碧图复制为带内容哈希的文件名
+（如 styles.css -> dist/styles.3f2a9c1b7e.css），模板通过 static_url() 引用，
+这些文件以 Cache-Control: immutable, max-age=31536000 下发，内容变化即换文件名。
+文本类资源同时生成 .gz 和 .br（需安装 brotli）预压缩文件，供 Nginx 的
+gzip_static / brotli_static 直接发送。上传目录不参与构建。
+修改静态资源或重新生成国旗雪碧图后需重新运行本脚本并重启服务。
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import re
+import shutil
+import sys
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，缺失时只生成 .gz
+    brotli = None
+
+BASE_DIR = Path(__file__).resolve().parent
+STATIC_DIR = BASE_DIR / "app" / "static"
+DIST_DIR = STATIC_DIR / "dist"
+
+# 参与构建的资源；uploads / temp_uploads 为用户上传内容，不做指纹
+ASSET_PATTERNS = ["*.css", "*.js", "flags/*.png", "sprites/*.png", "sprites/*.css"]
+COMPRESSIBLE = {".css", ".js", ".json", ".svg"}
+MIN_COMPRESS_SIZE = 1024
+
+CSS_URL_RE = re.compile(r"url\((['\"]?)/static/([^'\")]+)\1\)")
+
+def fingerprint(rel_path, data):
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    path = Path(rel_path)
+    if path.stem.endswith("." + digest):
+        # 已带内容哈希的文件（如雪碧图）保持原名
+        return path.as_posix()
+    return path.with_name(f"{path.stem}.{digest}{path.suffix}").as_posix()
+
+def write_compressed(target, data):
+    """写入 .gz / .br 预压缩文件，压缩后没有变小的跳过"""
+    written = []
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        target.with_name(target.name + ".gz").write_bytes(gz)
+        written.append("gz")
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            target.with_name(target.name + ".br").write_bytes(br)
+            written.append("br")
+    return written
+
+def collect_assets():
+    assets = []
+    for pattern in ASSET_PATTERNS:
+        assets.extend(p for p in STATIC_DIR.glob(pattern) if p.is_file())
+    # 图片先于样式处理，样式中的 url() 才能改写为带指纹的地址
+    return sorted(set(assets), key=lambda p: (p.suffix == ".css", str(p)))
+
+def build():
+    if DIST_DIR.exists():
+        shutil.rmtree(DIST_DIR)
+    DIST_DIR.mkdir(parents=True)
+
+    manifest = {}
+    compressed = 0
+    for path in collect_assets():
+        rel_path = path.relative_to(STATIC_DIR).as_posix()
+        data = path.read_bytes()
+        if path.suffix == ".css":
+            # 样式中引用的静态资源改为带指纹的地址
+            text = CSS_URL_RE.sub(
+                lambda m: f"url(/static/{manifest[m.group(2)]})" if m.group(2) in manifest else m.group(0),
+                data.decode("utf-8")
+            )
+            data = text.encode("utf-8")
+
+        hashed = "dist/" + fingerprint(rel_path, data)
+        target = STATIC_DIR / hashed
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+        manifest[rel_path] = hashed
+
+        if path.suffix in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE:
+            if write_compressed(target, data):
+                compressed += 1
+
+    (DIST_DIR / "manifest.json").write_text(
+        json.dumps(manifest, ensure_ascii=False, indent=1, sort_keys=True), encoding="utf-8"
+    )
+    print(f"[OK] {len(manifest)} 个资源已写入 {DIST_DIR}")
+    print(f"[OK] {compressed} 个文本资源生成了预压缩文件（.gz{'/.br' if brotli else '，未安装 brotli 跳过 .br'}）")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="生成带内容哈希的静态资源及预压缩文件")
+    parser.add_argument("--clean", action="store_true", help="删除 app/static/dist 后退出")
+    args = parser.parse_args()
+
+    if args.clean:
+        shutil.rmtree(DIST_DIR, ignore_errors=True)
+        print(f"[OK] 已删除 {DIST_DIR}")
+        return 0
+    return build()
+
+if __name__ == '__main__':
+    sys.exit(main())
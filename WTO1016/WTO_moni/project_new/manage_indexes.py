@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WTO会议系统索引管理脚本
+
+运行方法：
+python manage_indexes.py                         # 为主库及全部会期库应用索引清单
+python manage_indexes.py --check                 # 只报告缺失的索引，不做修改
+python manage_indexes.py --db countriesDB_12345  # 只处理指定数据库
+
+索引清单定义在 run.py 的 INDEX_MANIFEST / MASTER_INDEX_MANIFEST 中。
+"""
+
+import argparse
+import sys
+
+from run import (
+    client,
+    MASTER_DB_NAME,
+    list_session_databases,
+    find_missing_indexes,
+    apply_index_manifest,
+)
+
+def report_missing(db):
+    """打印并返回数据库缺失的索引数量"""
+    missing = find_missing_indexes(db)
+    if not missing:
+        print(f"[OK] {db.name}: 索引完整")
+    else:
+        print(f"[MISSING] {db.name}: 缺少 {len(missing)} 个索引")
+        for col_name, spec in missing:
+            unique = " (unique)" if spec.get("unique") else ""
+            print(f"   - {col_name}.{spec['name']}: {spec['keys']}{unique}")
+    return len(missing)
+
+def main():
+    parser = argparse.ArgumentParser(description="应用或检查WTO会议系统的MongoDB索引清单")
+    parser.add_argument("--check", action="store_true", help="只报告缺失的索引")
+    parser.add_argument("--db", action="append", help="指定数据库名，可重复；默认主库及全部会期库")
+    args = parser.parse_args()
+
+    db_names = args.db or [MASTER_DB_NAME] + list_session_databases()
+    print(f"共 {len(db_names)} 个数据库待{'检查' if args.check else '处理'}")
+
+    total_missing = 0
+    total_failed = 0
+    for name in db_names:
+        db = client[name]
+        if not args.check:
+            failed = apply_index_manifest(db)
+            total_failed += len(failed)
+            for col_name, index_name, error in failed:
+                print(f"[FAIL] {name}.{col_name}.{index_name}: {error}")
+        total_missing += report_missing(db)
+
+    print("=" * 50)
+    if total_missing or total_failed:
+        print(f"缺失索引: {total_missing}，创建失败: {total_failed}")
+        return 1
+    print("所有数据库索引完整")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
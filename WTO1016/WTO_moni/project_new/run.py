@@ -4,7 +4,9 @@ from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, ReturnDocument
+from pymongo.errors import OperationFailure, BulkWriteError, DuplicateKeyError
+from pymongo.monitoring import ConnectionPoolListener
 from werkzeug.utils import secure_filename
 from datetime import datetime, UTC, timedelta
 from pathlib import Path
@@ -23,11 +25,12 @@ from reportlab.lib.units import inch
 from reportlab.lib import colors
 from io import BytesIO
 import base64
+import copy
 from PyPDF2 import PdfReader
 from docx import Document
 import re
 import json
-from collections import Counter
+from collections import Counter, OrderedDict, defaultdict
 import bcrypt
 import uuid
 import hmac
@@ -36,6 +39,28 @@ import websocket
 import threading
 import time
 import ssl
+import gzip
+import math
+# =========================
+# Socket.IO 消息队列
+# =========================
+# 多个工作进程共享房间与广播时设置，例如：
+#   redis://redis:6379/0         Redis（需 pip install redis）
+#   local://127.0.0.1:6390       项目自带的 socketio_broker.py（仅限开发和测试：消息为 pickle 数据，
+#                                连接不做认证），只有使用该地址时才导入
+# 未设置时房间只存在于当前进程，只能运行单个工作进程
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+SOCKETIO_CHANNEL = os.getenv('SOCKETIO_CHANNEL', 'wto-socketio')
+
+def create_socketio_client_manager():
+    """local:// 使用 socketio_broker.py 中的开发用管理器；其他地址（redis:// 等）交给 Flask-SocketIO 的 message_queue 处理"""
+    if SOCKETIO_MESSAGE_QUEUE and SOCKETIO_MESSAGE_QUEUE.startswith('local://'):
+        from socketio_broker import LocalBrokerManager
+        return {"client_manager": LocalBrokerManager(SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL)}
+    if SOCKETIO_MESSAGE_QUEUE:
+        return {"message_queue": SOCKETIO_MESSAGE_QUEUE, "channel": SOCKETIO_CHANNEL}
+    return {}
+
 # =========================
 # Flask 初始化
 # =========================
@@ -55,7 +80,10 @@ app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=int(os.getenv('JWT_ACCE
 
 # 初始化扩展
 jwt = JWTManager(app)
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+# Socket.IO 异步模式：直接运行 run.py 时为 threading（开发用）；
+# 生产入口 wsgi_server.py 先完成 monkey-patch，再设置为 eventlet / gevent 后导入本模块
+SOCKETIO_ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE', 'threading')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=SOCKETIO_ASYNC_MODE, **create_socketio_client_manager())
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -64,17 +92,162 @@ login_manager.login_view = 'login'
 # MongoDB
 # =========================
 mongodb_uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
-client = MongoClient(mongodb_uri)
+
+def load_mongo_client_options():
+    """从环境变量读取连接池配置，未设置的项沿用 pymongo 默认值"""
+    options = {}
+    int_options = {
+        'MONGO_MAX_POOL_SIZE': 'maxPoolSize',
+        'MONGO_MIN_POOL_SIZE': 'minPoolSize',
+        'MONGO_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+        'MONGO_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    }
+    for env_name, option in int_options.items():
+        value = os.getenv(env_name)
+        if value:
+            options[option] = int(value)
+    compressors = os.getenv('MONGO_COMPRESSORS')  # 例如 zlib（zstd 需另装 zstandard）
+    if compressors:
+        options['compressors'] = compressors
+    return options
+
+MONGO_CLIENT_OPTIONS = load_mongo_client_options()
+
+class MongoPoolMetrics(ConnectionPoolListener):
+    """连接池指标：检出次数、检出等待时间、当前占用连接数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.checkins = 0
+            self.connections_created = 0
+            self.connections_closed = 0
+            self.wait_ms_total = 0.0
+            self.wait_ms_max = 0.0
+
+    def _record_wait(self):
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        if started is None:
+            return
+        wait_ms = (time.perf_counter() - started) * 1000
+        self.wait_ms_total += wait_ms
+        self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+
+    def connection_check_out_started(self, event):
+        # 检出在调用线程内同步完成，用线程局部变量记录开始时间
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checkouts += 1
+            self._record_wait()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+            self._record_wait()
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checkins += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self):
+        with self._lock:
+            attempts = self.checkouts + self.checkout_failures
+            return {
+                "options": MONGO_CLIENT_OPTIONS,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "in_use": self.checkouts - self.checkins,
+                "open_connections": self.connections_created - self.connections_closed,
+                "wait_ms_avg": round(self.wait_ms_total / attempts, 3) if attempts else 0,
+                "wait_ms_max": round(self.wait_ms_max, 3),
+            }
+
+
+mongo_pool_metrics = MongoPoolMetrics()
+
+def create_mongo_client():
+    return MongoClient(mongodb_uri, event_listeners=[mongo_pool_metrics], **MONGO_CLIENT_OPTIONS)
 
 # 主库（国家主数据统一存放）
 MASTER_DB_NAME = "countriesDB"
-MASTER_DB = client[MASTER_DB_NAME]
-MASTER_COUNTRIES = MASTER_DB["countries_lc"]
 
-# 用户管理集合
-USERS_COLLECTION = MASTER_DB["users"]
-USER_SESSIONS_COLLECTION = MASTER_DB["user_sessions"]
-MEETING_ROOMS_COLLECTION = MASTER_DB["meeting_rooms"]
+def bind_mongo_globals(new_client):
+    """把模块级的数据库/集合句柄绑定到指定客户端"""
+    global client, MASTER_DB, MASTER_COUNTRIES
+    global USERS_COLLECTION, USER_SESSIONS_COLLECTION, MEETING_ROOMS_COLLECTION
+    global col_countries, col_rollcall, col_submissions, col_temp_files, col_file_assignments, col_vote_files
+    client = new_client
+    MASTER_DB = client[MASTER_DB_NAME]
+    MASTER_COUNTRIES = MASTER_DB["countries_lc"]
+
+    # 用户管理集合
+    USERS_COLLECTION = MASTER_DB["users"]
+    USER_SESSIONS_COLLECTION = MASTER_DB["user_sessions"]
+    MEETING_ROOMS_COLLECTION = MASTER_DB["meeting_rooms"]
+
+    # 为兼容现有代码：保留默认集合指向主库
+    col_countries = MASTER_COUNTRIES
+    col_rollcall = MASTER_DB["rollcall"]
+    col_submissions = MASTER_DB["submissions"]
+    col_temp_files = MASTER_DB["temp_files"]
+    col_file_assignments = MASTER_DB["file_assignments"]
+    col_vote_files = MASTER_DB["vote_files"]
+
+bind_mongo_globals(create_mongo_client())
+
+def _reinit_mongo_after_fork():
+    """MongoClient 不能跨 fork 共享：预派生（gunicorn --preload 等）的子进程重新创建客户端。
+    不关闭继承来的客户端，避免向服务器结束父进程仍在使用的会话。
+    fork 时父进程的其他线程可能正持有任一模块级单例的锁（如 CountryIndex 刷新时
+    持锁查询 MongoDB），子进程把所有带锁的单例换成新对象，不调用会获取这些继承锁的方法；
+    缓存在子进程中按需重新加载，父进程缓冲的推送和在线登记不属于子进程，一并丢弃。
+    新增带锁的模块级单例时需加到这里。"""
+    global mongo_pool_metrics, session_contexts, meeting_settings, compression_metrics
+    global flag_manifest, country_index, broadcast_coalescer, presence
+    mongo_pool_metrics = MongoPoolMetrics()
+    session_contexts = SessionContextRegistry()
+    meeting_settings = MeetingSettingsRepository()
+    compression_metrics = CompressionMetrics()
+    flag_manifest = FlagManifest()
+    country_index = CountryIndex()
+    broadcast_coalescer = BroadcastCoalescer()
+    presence = PresenceRegistry()
+    bind_mongo_globals(create_mongo_client())
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_mongo_after_fork)
 
 import re
 
@@ -101,77 +274,1583 @@ def load_user(user_id):
         )
     return None
 
+# 会期上下文缓存容量（LRU淘汰），可通过环境变量调整
+SESSION_CONTEXT_CACHE_SIZE = int(os.getenv('SESSION_CONTEXT_CACHE_SIZE', 256))
+
+class SessionContext:
+    """单个会期的数据库上下文。
+    集合句柄只在创建时构建一次，兼容原先 get_cols_by_session 返回的字典用法（cols["settings"]）。
+    """
+
+    # 上下文键 -> 集合名
+    COLLECTIONS = {
+        "settings": "meeting_settings",
+        "rollcall": "rollcall",
+        "submissions": "submissions",
+        "temp_files": "temp_files",
+        "file_assignments": "file_assignments",
+        "vote_files": "vote_files",
+        "vote_results": "vote_results",
+        "file_vote_details": "file_vote_details",
+        "declarations": "declarations",
+        "chairman_settings": "chairman_settings",
+        "voting_mechanisms": "voting_mechanisms",
+    }
+
+    def __init__(self, session_id, db):
+        self.session_id = session_id
+        self.db = db
+        self.cols = {"db": db, "countries": MASTER_COUNTRIES}  # 国家主数据仍走主库
+        for key, name in self.COLLECTIONS.items():
+            self.cols[key] = db[name]
+
+    def __getitem__(self, key):
+        return self.cols[key]
+
+    def __contains__(self, key):
+        return key in self.cols
+
+    def get(self, key, default=None):
+        return self.cols.get(key, default)
+
+    def items(self):
+        return self.cols.items()
+
+
+class SessionContextRegistry:
+    """会期上下文注册表：按会议编号缓存 SessionContext，LRU 淘汰；
+    每个数据库的索引在首次使用时创建一次。"""
+
+    def __init__(self, maxsize=SESSION_CONTEXT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._contexts = OrderedDict()
+        self._indexed_dbs = set()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        key = str(session_id) if session_id else ""
+        with self._lock:
+            ctx = self._contexts.get(key)
+            if ctx is not None:
+                self._contexts.move_to_end(key)
+                return ctx
+
+        if re.fullmatch(r"\d{5}", key):
+            db = client[f"{MASTER_DB_NAME}_{key}"]
+        else:
+            db = MASTER_DB
+        ctx = SessionContext(key, db)
+        self.ensure_db_indexes(db)
+
+        with self._lock:
+            # 并发首次访问时以先写入者为准
+            ctx = self._contexts.setdefault(key, ctx)
+            self._contexts.move_to_end(key)
+            while len(self._contexts) > self.maxsize:
+                self._contexts.popitem(last=False)
+        return ctx
+
+    def ensure_db_indexes(self, db):
+        if db.name in self._indexed_dbs:
+            return
+        # 创建失败时不标记，下次访问重试
+        if ensure_indexes(db):
+            with self._lock:
+                self._indexed_dbs.add(db.name)
+
+    def invalidate(self, session_id=None):
+        """清除指定会期（或全部）的缓存上下文"""
+        with self._lock:
+            if session_id is None:
+                self._contexts.clear()
+                self._indexed_dbs.clear()
+            else:
+                self._contexts.pop(str(session_id), None)
+
+
+session_contexts = SessionContextRegistry()
+
 def get_cols_by_session(session_id: str):
     """根据五位数会议编号选择独立数据库，否则回落到主库。
-    返回各功能集合的句柄。
+    返回缓存的 SessionContext（各功能集合的句柄）。
+    """
+    return session_contexts.get(session_id)
+
+# =========================
+# 资源版本与条件请求（ETag）
+# =========================
+class ResourceVersions:
+    """按会期记录可轮询资源的版本号，用作 ETag。
+    版本号保存在会期库的 resource_versions 集合中，多个工作进程共享；
+    对应集合的写接口在写入后调用 bump()。epoch 在记录首次创建时生成，
+    记录被清除后重新计数也不会与客户端手里的旧 ETag 相同。
     """
-    if session_id and re.fullmatch(r"\d{5}", str(session_id)):
-        db = client[f"{MASTER_DB_NAME}_{session_id}"]
+    COLLECTION = "resource_versions"
+
+    def _collection(self, session_id):
+        return get_cols_by_session(session_id)["db"][self.COLLECTION]
+
+    def bump(self, session_id, resource, count=1):
+        """版本号加 count，返回更新后的 {"epoch", "version"}"""
+        return self._collection(session_id).find_one_and_update(
+            {"_id": f"{session_id}:{resource}"},
+            {"$inc": {"version": count}, "$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}},
+            projection={"_id": 0, "epoch": 1, "version": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    def current(self, session_id, resource):
+        """当前 {"epoch", "version"}，从未写入过时返回 None"""
+        return self._collection(session_id).find_one(
+            {"_id": f"{session_id}:{resource}"}, {"_id": 0, "epoch": 1, "version": 1}
+        )
+
+    def tag(self, session_id, resource):
+        doc = self.current(session_id, resource)
+        return f"{doc['epoch']}.{doc['version']}" if doc else "0"
+
+
+resource_versions = ResourceVersions()
+
+# 压缩后的响应在 ETag 后追加编码（"<tag>-br"），不同字节表示不共用同一个强校验值
+ETAG_ENCODING_SUFFIXES = ("br", "gzip")
+
+def etag_matches(etag):
+    """If-None-Match 是否命中 etag：客户端缓存的可能是压缩后的 "<tag>-br" / "<tag>-gzip"，
+    这些形式同样视为命中（弱比较）。命中时返回客户端持有的形式，否则返回 None"""
+    variants = [etag] + [f"{etag}-{encoding}" for encoding in ETAG_ENCODING_SUFFIXES]
+    return next((tag for tag in variants if request.if_none_match.contains_weak(tag)), None)
+
+def etag_response(etag, build):
+    """条件 GET：If-None-Match 命中时直接返回 304，不再查询和序列化；
+    否则调用 build() 生成响应，并在 200 响应上附带 ETag。
+    调用方应先读取版本再读取内容，这样并发写入最多导致多下发一次。"""
+    matched = etag_matches(etag)
+    if matched:
+        response = app.response_class(status=304)
+        response.set_etag(matched)
+        response.vary.add("Accept-Encoding")
     else:
-        db = MASTER_DB
+        response = app.make_response(build())
+        if response.status_code != 200:
+            return response
+        response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def with_server_time(response):
+    """附带服务器当前时间（X-Server-Time，秒），304 也带，客户端据此校正本地时钟"""
+    response.headers["X-Server-Time"] = f"{time.time():.3f}"
+    return response
+
+# =========================
+# 会议设置仓库
+# =========================
+# 会议设置缓存有效期（秒）；写接口会主动失效本进程缓存，TTL 仅用于约束多进程间的陈旧时间
+SETTINGS_CACHE_TTL = float(os.getenv('SETTINGS_CACHE_TTL', 5))
+
+class MeetingSettingsRepository:
+    """会议设置的唯一入口。
+    权威存储为 get_cols_by_session(session_id)["settings"]（五位数会期为专属库，其余为主库），
+    不再向主库 meeting_settings 双写；读取经由带 TTL 的进程内缓存，写入后使缓存失效。
+    旧版本把加入的参与国只写在主库 meeting_settings 中：专属库的文档首次读取时
+    把主库副本中的参与国合并进来，并以 global_settings_merged 标记，之后不再查主库。
+    """
+    MERGED_FIELD = "global_settings_merged"
+
+    def __init__(self, ttl=SETTINGS_CACHE_TTL):
+        self.ttl = ttl
+        self._projection = {}  # session_id -> (文档, 过期时间)
+        self._versions = {}  # 每次失效递增，避免并发读把旧文档写回缓存
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _collection(self, session_id):
+        return get_cols_by_session(session_id)["settings"]
+
+    def _merge_global_participants(self, collection, doc):
+        """把主库 meeting_settings 中旧的参与国合并进专属库文档（每个会期只执行一次），返回最新文档"""
+        session_id = doc["session_id"]
+        legacy = MASTER_DB["meeting_settings"].find_one({"session_id": session_id}, {"participants": 1}) or {}
+        merged = 0
+        for participant in legacy.get("participants", []):
+            if not isinstance(participant, dict) or not participant.get("country_id"):
+                continue
+            result = collection.update_one(
+                {"session_id": session_id, "participants.country_id": {"$ne": participant["country_id"]}},
+                {"$push": {"participants": participant}}
+            )
+            merged += result.modified_count
+        collection.update_one(
+            {"session_id": session_id},
+            {"$set": {self.MERGED_FIELD: True}, "$inc": {"settings_version": 1}}
+        )
+        if merged:
+            print(f"[INFO] 会期 {session_id}: 从主库 meeting_settings 合并 {merged} 个参与国")
+        return collection.find_one({"session_id": session_id})
+
+    def get(self, session_id):
+        """读取会议设置文档（副本），不存在时返回 None"""
+        key = str(session_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._projection.get(key)
+            version = self._versions.get(key, 0)
+            if entry is not None and entry[1] > now:
+                self.hits += 1
+                return copy.deepcopy(entry[0])
+            self.misses += 1
+
+        collection = self._collection(session_id)
+        doc = collection.find_one({"session_id": session_id})
+        if doc is None:
+            # 不缓存不存在的会议，避免其他进程刚创建的会议被误判
+            return None
+        if not doc.get(self.MERGED_FIELD) and collection.database.name != MASTER_DB_NAME:
+            doc = self._merge_global_participants(collection, doc)
+        with self._lock:
+            if self._versions.get(key, 0) == version:
+                self._projection[key] = (doc, now + self.ttl)
+            if len(self._projection) > 1024:
+                self._projection = {k: v for k, v in self._projection.items() if v[1] > now}
+        return copy.deepcopy(doc)
+
+    def create(self, session_id, record):
+        """创建会议设置文档"""
+        record.setdefault("settings_version", 1)
+        # 新会议不存在主库副本，无需合并
+        record.setdefault(self.MERGED_FIELD, True)
+        result = self._collection(session_id).insert_one(record)
+        self.invalidate(session_id)
+        return result
+
+    def update(self, session_id, update, upsert=False, extra_filter=None):
+        """更新会议设置文档；extra_filter 用于条件更新"""
+        query = {"session_id": session_id}
+        if extra_filter:
+            query.update(extra_filter)
+        # 每次写入递增版本号，作为会议信息类接口的 ETag
+        update = dict(update)
+        update["$inc"] = dict(update.get("$inc", {}), settings_version=1)
+        result = self._collection(session_id).update_one(query, update, upsert=upsert)
+        self.invalidate(session_id)
+        return result
+
+    def has_participant(self, session_id, country_id):
+        doc = self.get(session_id) or {}
+        return any(p.get("country_id") == country_id for p in doc.get("participants", []) if isinstance(p, dict))
+
+    def add_participant(self, session_id, participant):
+        """原子地追加参与国；该国已加入时不修改（modified_count 为 0）"""
+        return self.update(
+            session_id,
+            {"$push": {"participants": participant}},
+            extra_filter={"participants.country_id": {"$ne": participant["country_id"]}}
+        )
+
+    @staticmethod
+    def etag(doc):
+        """会议设置文档的版本标签；_id 区分同一会期号被删除后重建的文档"""
+        return f"settings-{doc['_id']}.{doc.get('settings_version', 0)}" if doc else "settings-none"
+
+    def invalidate(self, session_id=None):
+        """使指定会期（或全部）的缓存失效"""
+        with self._lock:
+            keys = list(self._projection) if session_id is None else [str(session_id)]
+            for key in keys:
+                self._projection.pop(key, None)
+                self._versions[key] = self._versions.get(key, 0) + 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "ttl": self.ttl,
+                "entries": len(self._projection),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0,
+                "invalidations": self.invalidations,
+            }
+
+
+meeting_settings = MeetingSettingsRepository()
+
+# =========================
+# 静态资源指纹
+# =========================
+# build_static_assets.py 生成的清单：原始路径 -> dist/ 下带内容哈希的路径
+STATIC_MANIFEST = os.path.join(app.static_folder, "dist", "manifest.json")
+STATIC_DIST_PREFIX = "/static/dist/"
+STATIC_IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+def load_static_manifest():
+    """读取静态资源清单，未构建时返回空字典（模板回退为原始路径）"""
+    try:
+        with open(STATIC_MANIFEST, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+static_manifest = load_static_manifest()
+
+def static_url(filename):
+    """模板使用的静态资源地址：已构建时返回带指纹的 /static/dist/... ，否则返回 /static/<filename>"""
+    hashed = static_manifest.get(filename)
+    return f"/static/{hashed}" if hashed else f"/static/{filename}"
+
+app.jinja_env.globals["static_url"] = static_url
+
+@app.after_request
+def add_static_cache_headers(response):
+    """带指纹的资源内容变化即换文件名，可以让浏览器和代理永久缓存"""
+    if request.path.startswith(STATIC_DIST_PREFIX) and response.status_code == 200:
+        response.headers["Cache-Control"] = STATIC_IMMUTABLE_CACHE
+    return response
+
+# =========================
+# JSON 响应压缩
+# =========================
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，缺失时只协商 gzip
+    brotli = None
+
+# 小于该字节数的 JSON 不压缩（压缩收益抵不过 CPU 开销）
+JSON_COMPRESS_MIN_SIZE = int(os.getenv('JSON_COMPRESS_MIN_SIZE', 1024))
+JSON_GZIP_LEVEL = int(os.getenv('JSON_GZIP_LEVEL', 6))
+JSON_BROTLI_QUALITY = int(os.getenv('JSON_BROTLI_QUALITY', 5))
+
+class CompressionMetrics:
+    """按接口统计 JSON 压缩的次数与节省字节数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, encoding, raw_size, compressed_size):
+        with self._lock:
+            entry = self._endpoints.setdefault(endpoint, {
+                "responses": 0, "gzip": 0, "br": 0, "bytes_in": 0, "bytes_out": 0
+            })
+            entry["responses"] += 1
+            entry[encoding] += 1
+            entry["bytes_in"] += raw_size
+            entry["bytes_out"] += compressed_size
+
+    def stats(self):
+        with self._lock:
+            endpoints = {
+                name: dict(entry,
+                           bytes_saved=entry["bytes_in"] - entry["bytes_out"],
+                           ratio=round(entry["bytes_out"] / entry["bytes_in"], 3) if entry["bytes_in"] else 0)
+                for name, entry in self._endpoints.items()
+            }
+        return {
+            "min_size": JSON_COMPRESS_MIN_SIZE,
+            "gzip_level": JSON_GZIP_LEVEL,
+            "brotli_quality": JSON_BROTLI_QUALITY if brotli else None,
+            "bytes_saved": sum(e["bytes_saved"] for e in endpoints.values()),
+            "endpoints": endpoints,
+        }
+
+
+compression_metrics = CompressionMetrics()
+
+def negotiate_encoding():
+    """根据 Accept-Encoding 选择压缩方式，brotli 优先"""
+    accept = request.accept_encodings
+    if brotli is not None and accept["br"]:
+        return "br"
+    if accept["gzip"]:
+        return "gzip"
+    return None
+
+@app.after_request
+def compress_json_response(response):
+    """超过阈值的 JSON 响应按客户端声明的编码压缩（投票矩阵、国家列表、PDF base64 等大响应）"""
+    if (response.mimetype != "application/json" or response.status_code != 200
+            or response.direct_passthrough or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    encoding = negotiate_encoding() if len(data) >= JSON_COMPRESS_MIN_SIZE else None
+    if encoding is None:
+        return response
+
+    if encoding == "br":
+        compressed = brotli.compress(data, quality=JSON_BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(data, compresslevel=JSON_GZIP_LEVEL)
+    if len(compressed) >= len(data):
+        return response
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    compression_metrics.record(request.endpoint or request.path, encoding, len(data), len(compressed))
+    return response
+
+# =========================
+# 国旗清单
+# =========================
+FLAG_DIR = os.path.join(app.static_folder, "flags")
+DEFAULT_FLAG_URL = "/static/flags/default.png"
+# 目录检查间隔（秒）：到期后只 stat 一次目录，修改时间变化才重新扫描
+FLAG_MANIFEST_POLL_INTERVAL = float(os.getenv('FLAG_MANIFEST_POLL_INTERVAL', 10))
+
+class FlagManifest:
+    """app/static/flags 的文件清单（文件名、大小、内容哈希）。
+    启动时扫描一次，国旗解析只做字典查找，不再每个请求对每个国家 os.path.exists。
+    目录有增删时由轮询自动重扫；原地覆盖文件内容需调用 POST /api/flags/refresh。
+    """
+
+    def __init__(self, flag_dir=FLAG_DIR, poll_interval=FLAG_MANIFEST_POLL_INTERVAL):
+        self.flag_dir = flag_dir
+        self.poll_interval = poll_interval
+        self._files = {}
+        self.version = ""
+        self._dir_mtime = None
+        self._next_poll = 0
+        self._lock = threading.Lock()
+        self.scans = 0
+
+    def _dir_signature(self):
+        try:
+            return os.stat(self.flag_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def scan(self):
+        """重新扫描国旗目录"""
+        files = {}
+        signature = self._dir_signature()
+        if signature is not None:
+            for entry in os.scandir(self.flag_dir):
+                if not entry.is_file() or not entry.name.lower().endswith(".png"):
+                    continue
+                with open(entry.path, "rb") as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()[:16]
+                files[entry.name] = {"size": entry.stat().st_size, "hash": digest}
+        version = hashlib.sha256(
+            "".join(f"{name}:{info['hash']};" for name, info in sorted(files.items())).encode()
+        ).hexdigest()[:12]
+        with self._lock:
+            self._files = files
+            self.version = version
+            self._dir_mtime = signature
+            self._next_poll = time.monotonic() + self.poll_interval
+            self.scans += 1
+        return len(files)
+
+    def _poll(self):
+        if time.monotonic() < self._next_poll:
+            return
+        with self._lock:
+            if time.monotonic() < self._next_poll:
+                return
+            self._next_poll = time.monotonic() + self.poll_interval
+            changed = self._dir_signature() != self._dir_mtime
+        if changed:
+            self.scan()
+
+    def get(self, filename):
+        """返回 {"size", "hash"}，文件不存在时返回 None"""
+        if not filename:
+            return None
+        self._poll()
+        return self._files.get(filename)
+
+    def url(self, filename, default=DEFAULT_FLAG_URL):
+        return f"/static/flags/{filename}" if self.get(filename) else default
+
+    def filenames(self):
+        self._poll()
+        return sorted(self._files)
+
+    def stats(self):
+        return {
+            "files": len(self._files),
+            "bytes": sum(f["size"] for f in self._files.values()),
+            "scans": self.scans,
+            "poll_interval": self.poll_interval,
+        }
+
+
+flag_manifest = FlagManifest()
+flag_manifest.scan()
+
+# 国旗雪碧图清单（由 build_flag_sprites.py 生成）
+FLAG_SPRITE_MANIFEST = os.path.join(app.static_folder, "sprites", "flags.json")
+
+def load_flag_sprites():
+    """读取雪碧图清单，返回页面使用的精简结构 {"css", "flags": {文件名: [雪碧图序号, CSS类名]}}；
+    未构建时返回 None，页面回退到单独的国旗文件"""
+    try:
+        with open(FLAG_SPRITE_MANIFEST, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
     return {
-        "db": db,
-        "countries": MASTER_COUNTRIES,  # 国家主数据仍走主库
-        "settings": db["meeting_settings"],
-        "rollcall": db["rollcall"],
-        "submissions": db["submissions"],
-        "temp_files": db["temp_files"],
-        "file_assignments": db["file_assignments"],
-        "vote_files": db["vote_files"],
-        "vote_results": db["vote_results"],
-        "file_vote_details": db["file_vote_details"],
-        "declarations": db["declarations"],
-        "chairman_settings": db["chairman_settings"],
-        "voting_mechanisms": db["voting_mechanisms"],
+        "css": static_url("sprites/flags.css"),
+        "flags": {name: [info["sheet"], info["class"]] for name, info in manifest.get("flags", {}).items()},
     }
 
-# 为兼容现有代码：保留默认集合指向主库
-col_countries = MASTER_COUNTRIES
-col_settings  = MASTER_DB["meeting_settings"]
-col_rollcall = MASTER_DB["rollcall"]
-col_submissions = MASTER_DB["submissions"]
-col_temp_files = MASTER_DB["temp_files"]
-# 工具方法：确保会话在全局集合存在
-def ensure_session_in_global(session_id: str) -> bool:
-    try:
-        if not session_id:
-            return False
-        # 已存在则返回
-        if col_settings.find_one({"session_id": session_id}):
-            return True
-        # 尝试从会期专属库同步
-        cols = get_cols_by_session(session_id)
-        sdoc = cols["settings"].find_one({"session_id": session_id})
-        if not sdoc:
-            return False
-        payload = {
-            "session_id": sdoc.get("session_id"),
-            "committee_name": sdoc.get("committee_name"),
-            "agenda": sdoc.get("agenda"),
-            "created_by": sdoc.get("created_by"),
-            "created_at": sdoc.get("created_at"),
-            "status": sdoc.get("status", "active"),
-            "participants": sdoc.get("participants", []),
-            "meeting_state": sdoc.get("meeting_state", {}),
-            "chairman_controls": sdoc.get("chairman_controls", {}),
+flag_sprites = load_flag_sprites()
+
+@app.context_processor
+def inject_flag_sprites():
+    return {"flag_sprites": flag_sprites}
+
+# 国旗文件名与区域指示符 emoji 代码不一致的情况
+FLAG_EMOJI_CODE_ALIASES = {"uk": "gb"}
+DEFAULT_FLAG_EMOJI = "🏳️"
+
+def flag_emoji_for_code(code):
+    """两位 ISO 代码 -> 国旗 emoji（区域指示符），无法转换时返回白旗"""
+    code = FLAG_EMOJI_CODE_ALIASES.get((code or "").lower(), (code or "").lower())
+    if len(code) != 2 or not (code.isascii() and code.isalpha()):
+        return DEFAULT_FLAG_EMOJI
+    return "".join(chr(0x1F1E6 + ord(c) - ord("a")) for c in code)
+
+# =========================
+# 国家主数据索引
+# =========================
+# countries_lc 几乎不变，整表加载到进程内；到期后在下一次查询时重新加载
+COUNTRY_INDEX_TTL = float(os.getenv('COUNTRY_INDEX_TTL', 300))
+
+class CountryIndex:
+    """国家主数据的进程内索引，可按 ObjectId 字符串、国家代码或中文名 O(1) 查找。
+    取代各接口里逐个 MASTER_COUNTRIES.find_one 以及 ObjectId() 解析失败时按名称兜底的写法。
+    """
+
+    def __init__(self, ttl=COUNTRY_INDEX_TTL):
+        self.ttl = ttl
+        self._entries = []
+        self._by_key = {}
+        self.version = ""
+        self._expires_at = 0
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    @staticmethod
+    def _flag_filename(doc):
+        """兼容原有字段：flag / flag_url 存路径，code 为 ISO 代码"""
+        path = doc.get("flag") or doc.get("flag_url")
+        if path:
+            return os.path.basename(path)
+        if doc.get("code"):
+            return f"{doc['code'].lower()}.png"
+        return None
+
+    def _load(self):
+        entries = []
+        by_key = {}
+        for doc in MASTER_COUNTRIES.find({}, {"country_name": 1, "name": 1, "code": 1, "flag": 1, "flag_url": 1}):
+            flag = self._flag_filename(doc)
+            code = (doc.get("code") or "").lower()
+            if not code and flag:
+                # 只存了国旗路径的记录（如 .../flags/cn.png），用文件名推出代码
+                stem = os.path.splitext(flag)[0].lower()
+                code = stem if stem.isascii() and stem.isalpha() else ""
+            entry = {
+                "id": str(doc["_id"]),
+                "name": doc.get("country_name") or doc.get("name") or "未知国家",
+                "code": code,
+                "flag": flag,
+                "emoji": flag_emoji_for_code(code),
+            }
+            entries.append(entry)
+            # 按优先级登记：ObjectId > 代码 > 名称，先登记的不被覆盖
+            for key in (entry["id"], entry["code"], doc.get("country_name"), doc.get("name")):
+                if key:
+                    by_key.setdefault(str(key).strip(), entry)
+        return entries, by_key
+
+    def _ensure_loaded(self):
+        if time.monotonic() < self._expires_at:
+            return
+        with self._lock:
+            if time.monotonic() < self._expires_at:
+                return
+            self._entries, self._by_key = self._load()
+            # 内容哈希：TTL 到期重新加载但数据未变时 ETag 保持不变
+            self.version = hashlib.sha256(
+                json.dumps(self._entries, ensure_ascii=False, sort_keys=True).encode("utf-8")
+            ).hexdigest()[:12]
+            self._expires_at = time.monotonic() + self.ttl
+            self.loads += 1
+
+    def refresh(self):
+        """立即重新加载（国家数据变更后调用）"""
+        with self._lock:
+            self._expires_at = 0
+        self._ensure_loaded()
+
+    def lookup(self, key):
+        """按 ObjectId/代码/名称查找，返回条目字典（勿修改）或 None"""
+        if key is None:
+            return None
+        self._ensure_loaded()
+        key = str(key).strip()
+        return self._by_key.get(key) or self._by_key.get(key.lower())
+
+    def name(self, key, default="未知国家"):
+        entry = self.lookup(key)
+        return entry["name"] if entry else default
+
+    def code(self, key, default=""):
+        entry = self.lookup(key)
+        return entry["code"] if entry else default
+
+    def flag_url(self, key, default=DEFAULT_FLAG_URL):
+        """国旗 URL，文件不在国旗清单中时返回 default"""
+        entry = self.lookup(key)
+        return flag_manifest.url(entry["flag"], default) if entry else default
+
+    def all(self):
+        """全部国家（countries_lc 中的顺序），附带解析后的 flag_url"""
+        self._ensure_loaded()
+        return [dict(entry, flag_url=flag_manifest.url(entry["flag"])) for entry in self._entries]
+
+    def etag(self):
+        """国家列表的版本标签（国家数据 + 国旗清单）"""
+        self._ensure_loaded()
+        flag_manifest.filenames()  # 触发目录轮询
+        return f"countries-{self.version}-{flag_manifest.version}"
+
+    def stats(self):
+        return {
+            "ttl": self.ttl,
+            "countries": len(self._entries),
+            "keys": len(self._by_key),
+            "loads": self.loads,
         }
-        col_settings.insert_one(payload)
+
+
+country_index = CountryIndex()
+
+def resolve_country_flag(country_id=None, country_name=None):
+    """页面路由共用的国旗解析：按国家 id、名称或代码返回 (国旗 URL, emoji)"""
+    entry = country_index.lookup(country_id) or country_index.lookup(country_name)
+    if entry:
+        return flag_manifest.url(entry["flag"]), entry["emoji"]
+    # countries_lc 中没有的记录：直接传入国家代码时按代码匹配国旗文件
+    code = (country_name or "").strip().lower()
+    if code and flag_manifest.get(f"{code}.png"):
+        return f"/static/flags/{code}.png", flag_emoji_for_code(code)
+    return DEFAULT_FLAG_URL, DEFAULT_FLAG_EMOJI
+
+# =========================
+# 索引清单（声明式，应用到主库及每个 countriesDB_XXXXX 会期库）
+# =========================
+# 集合名 -> 索引列表；每个索引为 {"keys": [...], "name": ..., "unique": bool}，
+# 可选 "expire_after_seconds" 建为 TTL 索引
+# 投票变更记录的保存时长（秒），由 file_vote_changes 上的 TTL 索引在后台清理
+VOTE_CHANGE_TTL = int(os.getenv('VOTE_CHANGE_TTL', 3600))
+
+INDEX_MANIFEST = {
+    "submissions": [
+        # 一国在同一会期只能提交一次
+        {"keys": [("country_id", 1), ("session_id", 1)], "name": "uniq_country_session", "unique": True},
+    ],
+    "meeting_settings": [
+        {"keys": [("session_id", 1)], "name": "uniq_session", "unique": True},
+    ],
+    "rollcall": [
+        {"keys": [("session_id", 1), ("country_id", 1)], "name": "uniq_session_country", "unique": True},
+        {"keys": [("session_id", 1), ("arrived", 1)], "name": "session_arrived"},
+    ],
+    "file_vote_details": [
+        {"keys": [("session_id", 1), ("file_id", 1), ("country_id", 1)], "name": "uniq_session_file_country", "unique": True},
+        {"keys": [("session_id", 1), ("country_id", 1)], "name": "session_country"},
+    ],
+    "file_vote_changes": [
+        {"keys": [("session_id", 1), ("epoch", 1), ("seq", 1)], "name": "uniq_session_epoch_seq", "unique": True},
+        {"keys": [("created_at", 1)], "name": "ttl_created_at", "expire_after_seconds": VOTE_CHANGE_TTL},
+    ],
+    "passed_files": [
+        {"keys": [("session_id", 1), ("file_id", 1)], "name": "uniq_session_file", "unique": True},
+        {"keys": [("session_id", 1), ("status", 1)], "name": "session_status"},
+    ],
+    "declarations": [
+        {"keys": [("session_id", 1), ("created_at", -1)], "name": "session_created_at"},
+        {"keys": [("session_id", 1), ("generated_at", -1)], "name": "session_generated_at"},
+    ],
+    "speaking_orders": [
+        {"keys": [("session_id", 1)], "name": "uniq_session", "unique": True},
+    ],
+    "declaration_confirmations": [
+        {"keys": [("session_id", 1), ("country_id", 1)], "name": "uniq_session_country", "unique": True},
+    ],
+    "declaration_feedback": [
+        {"keys": [("session_id", 1), ("country_id", 1)], "name": "uniq_session_country", "unique": True},
+    ],
+    "country_vote_submissions": [
+        {"keys": [("session_id", 1), ("country_id", 1)], "name": "uniq_session_country", "unique": True},
+    ],
+    "temp_files": [
+        # 上传时尚未分配 file_id，因此不能设为唯一
+        {"keys": [("session_id", 1), ("file_id", 1)], "name": "session_file"},
+    ],
+    "vote_files": [
+        {"keys": [("session_id", 1), ("file_id", 1)], "name": "session_file"},
+    ],
+    "file_assignments": [
+        {"keys": [("session_id", 1)], "name": "session"},
+    ],
+    "voting_records": [
+        {"keys": [("session_id", 1)], "name": "session"},
+    ],
+    "motion_records": [
+        {"keys": [("session_id", 1), ("status", 1), ("created_at", -1)], "name": "session_status_created_at"},
+    ],
+    "meeting_status": [
+        {"keys": [("session_id", 1)], "name": "uniq_session", "unique": True},
+    ],
+}
+
+# 仅主库存在的集合
+MASTER_INDEX_MANIFEST = {
+    "users": [
+        {"keys": [("username", 1)], "name": "uniq_username", "unique": True},
+        {"keys": [("email", 1)], "name": "uniq_email", "unique": True},
+    ],
+    "user_sessions": [
+        {"keys": [("user_id", 1), ("room_id", 1)], "name": "user_room"},
+    ],
+    "meeting_rooms": [
+        {"keys": [("room_id", 1)], "name": "uniq_room_id", "unique": True},
+        {"keys": [("session_id", 1)], "name": "session"},
+    ],
+}
+
+# 已被替换的索引：应用清单时删除。file_vote_changes 的唯一键加入 epoch 后，
+# 旧的 (session_id, seq) 唯一索引会让重新计数的序列号与旧记录冲突
+OBSOLETE_INDEXES = {
+    "file_vote_changes": ["uniq_session_seq"],
+}
+
+SESSION_DB_PATTERN = re.compile(rf"{MASTER_DB_NAME}_\d{{5}}")
+
+def get_index_manifest(target_db):
+    """返回应用到指定数据库的索引清单"""
+    if target_db.name == MASTER_DB_NAME:
+        return {**INDEX_MANIFEST, **MASTER_INDEX_MANIFEST}
+    return INDEX_MANIFEST
+
+def list_session_databases():
+    """列出所有会期专属数据库名（countriesDB_XXXXX）"""
+    return sorted(name for name in client.list_database_names() if SESSION_DB_PATTERN.fullmatch(name))
+
+def find_missing_indexes(target_db):
+    """对比清单与数据库现有索引，返回缺失的 [(集合名, 索引定义)]。
+    按键和唯一性比较，不要求索引名一致。"""
+    missing = []
+    for col_name, specs in get_index_manifest(target_db).items():
+        existing = target_db[col_name].index_information()
+        existing_keys = {
+            (tuple(tuple(k) for k in info["key"]), bool(info.get("unique", False)))
+            for info in existing.values()
+        }
+        for spec in specs:
+            if (tuple(spec["keys"]), spec.get("unique", False)) not in existing_keys:
+                missing.append((col_name, spec))
+    return missing
+
+def apply_index_manifest(target_db):
+    """按清单为数据库创建索引。
+    单个索引因数据冲突（如已有重复数据）失败时记录并继续；连接错误向上抛出。
+    返回失败列表 [(集合名, 索引名, 错误信息)]。"""
+    failed = []
+    for col_name, names in OBSOLETE_INDEXES.items():
+        existing = target_db[col_name].index_information()
+        for name in names:
+            if name in existing:
+                try:
+                    target_db[col_name].drop_index(name)
+                except OperationFailure as e:
+                    print(f"删除旧索引失败({target_db.name}.{col_name}.{name}): {e}")
+                    failed.append((col_name, name, str(e)))
+    for col_name, specs in get_index_manifest(target_db).items():
+        for spec in specs:
+            options = {"unique": spec.get("unique", False)}
+            if "expire_after_seconds" in spec:
+                options["expireAfterSeconds"] = spec["expire_after_seconds"]
+            try:
+                target_db[col_name].create_index(spec["keys"], name=spec["name"], **options)
+            except OperationFailure as e:
+                print(f"创建索引失败({target_db.name}.{col_name}.{spec['name']}): {e}")
+                failed.append((col_name, spec["name"], str(e)))
+    return failed
+
+def ensure_indexes(target_db):
+    """应用索引清单；数据库不可用时返回 False 以便下次重试"""
+    try:
+        apply_index_manifest(target_db)
         return True
-    except Exception as _e:
-        print(f"ensure_session_in_global 失败: {_e}")
+    except Exception as e:
+        print(f"创建索引失败({target_db.name}): {e}")
         return False
 
-col_file_assignments = MASTER_DB["file_assignments"]
-col_vote_files = MASTER_DB["vote_files"]
+# 主库部分集合不经过 get_cols_by_session 访问（col_rollcall 等），启动时即应用清单
+session_contexts.ensure_db_indexes(MASTER_DB)
 
-# 索引：一国在同一会期只能提交一次（主库默认）
-col_submissions.create_index([("country_id", 1), ("session_id", 1)], unique=True, name="uniq_country_session")
+# =========================
+# 批量写入工具
+# =========================
+def _filter_key(flt):
+    return tuple(sorted(flt.items()))
+
+def bulk_upsert(collection, items, guards=None):
+    """以无序 bulk_write 批量执行 update_one(filter, {"$set": doc}, upsert=True)。
+
+    items: [(filter, set_doc), ...]，filter 为等值条件
+    返回 {"outcomes": [...], "errors": [...], "counts": {...}}，
+    outcomes 与 items 一一对应，取值 upserted / modified / unchanged / stale / error。
+    写入前用一次 $or 查询读出已有文档：字段值全部相同的记录不再写入（unchanged），
+    其余记录分为插入和修改两类分别写入。同一批内重复的 filter 只写最后一条，
+    之前的条目与它的结果相同。并发写入导致修改数对不上时，逐条读回判断。
+    guards 与 items 一一对应时作为附加写入条件（如版本号比较）：已有文档只做条件更新，
+    条件不成立、或插入时被并发写入抢先（唯一索引冲突）的条目为 stale。
+    """
+    if not items:
+        return {"outcomes": [], "errors": [], "counts": {}}
+
+    keys = [_filter_key(flt) for flt, _ in items]
+    last_index = {key: i for i, key in enumerate(keys)}
+    shapes = {tuple(field for field, _ in key) for key in last_index}
+    existing = {}
+    for doc in collection.find({"$or": [dict(key) for key in last_index]}):
+        for shape in shapes:
+            key = tuple((field, doc.get(field)) for field in shape)
+            if key in last_index:
+                existing[key] = doc
+
+    outcomes = [None] * len(items)
+    inserts, updates = [], []
+    for key, i in last_index.items():
+        current = existing.get(key)
+        if current is None:
+            inserts.append(i)
+        elif all(current.get(field) == value for field, value in items[i][1].items()):
+            outcomes[i] = "unchanged"
+        else:
+            updates.append(i)
+    op_indexes = inserts + updates
+    if guards is None:
+        operations = [UpdateOne(items[i][0], {"$set": items[i][1]}, upsert=True) for i in op_indexes]
+    else:
+        operations = [UpdateOne(dict(items[i][0], **guards[i]), {"$set": items[i][1]}, upsert=i in inserts)
+                      for i in op_indexes]
 
-def ensure_indexes(target_db):
+    if operations:
+        try:
+            details = collection.bulk_write(operations, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+    else:
+        details = {}
+
+    errors = []
+    for up in details.get("upserted", []):
+        outcomes[op_indexes[up["index"]]] = "upserted"
+    for err in details.get("writeErrors", []):
+        i = op_indexes[err["index"]]
+        if guards is not None and err.get("code") == 11000:
+            outcomes[i] = "stale"
+            continue
+        outcomes[i] = "error"
+        errors.append({"index": i, "message": err.get("errmsg", "")})
+
+    # 剩下的都是匹配到已有文档的写入：修改数与之相等时全部为 modified，
+    # 否则（读写之间有并发写入或守卫不成立）逐条读回，值已是本次写入的视为 modified
+    matched = [i for i in op_indexes if outcomes[i] is None]
+    if details.get("nModified", 0) == len(matched):
+        for i in matched:
+            outcomes[i] = "modified"
+    else:
+        for i in matched:
+            flt, doc = items[i]
+            current = collection.find_one(flt) or {}
+            same = all(current.get(field) == value for field, value in doc.items())
+            outcomes[i] = "modified" if same else ("unchanged" if guards is None else "stale")
+
+    for i, key in enumerate(keys):
+        if outcomes[i] is None:
+            outcomes[i] = outcomes[last_index[key]]
+            if outcomes[i] == "error":
+                errors.append({"index": i, "message": "同一批中该记录的最后一条写入失败"})
+
+    return {"outcomes": outcomes, "errors": errors, "counts": dict(Counter(outcomes))}
+
+# =========================
+# 列表接口字段投影
+# =========================
+# 列表接口声明自己返回的字段，查询时下推为投影，避免读取整篇文档。
+# 大文本字段（如 vote_files/temp_files 的 extracted_text）只有在
+# 请求参数 include=extracted_text（逗号分隔）显式要求时才读取。
+LARGE_TEXT_FIELDS = ("extracted_text",)
+
+SUBMISSION_LIST_FIELDS = ("country_id", "text", "file_name", "created_at")
+TEMP_FILE_LIST_FIELDS = ("file_id", "file_name", "original_name", "file_size", "content_type", "uploaded_at")
+VOTE_FILE_LIST_FIELDS = ("file_id", "file_name", "country_id", "country_name", "country_flag",
+                         "vote_status", "vote_result", "created_at")
+VOTE_DETAIL_LIST_FIELDS = ("country_id", "file_id", "vote_result")
+
+def requested_optional_fields():
+    """解析 include 参数，只接受 LARGE_TEXT_FIELDS 中的字段"""
+    raw = request.args.get("include") or ""
+    return {f.strip() for f in raw.split(",") if f.strip() in LARGE_TEXT_FIELDS}
+
+def list_projection(fields, include_id=False, optional=()):
+    """由字段声明生成投影；optional 中的字段仅在被请求时加入"""
+    projection = {field: 1 for field in fields}
+    if optional:
+        for field in requested_optional_fields() & set(optional):
+            projection[field] = 1
+    if not include_id:
+        projection["_id"] = 0
+    return projection
+
+# =========================
+# 实时推送（服务端发起的 Socket.IO 广播）
+# =========================
+# 高频推送（投票、点名、在线变化）按 房间+事件 缓冲该毫秒数后合并为一条发出；0 表示立即发送
+BROADCAST_COALESCE_WINDOW_MS = int(os.getenv('BROADCAST_COALESCE_WINDOW_MS', 100))
+
+class BroadcastCoalescer:
+    """按 (房间, 事件) 合并窗口期内的推送。
+    窗口内第一次提交时启动后台任务，window 秒后把缓冲的条目交给 build 生成一条消息发出。
+    条目按 key 去重：同一 key 只保留最后一次写入，并移到队尾（保持最后写入的先后顺序）；
+    提供 merge(旧条目, 新条目) 时由它生成保留的条目。
+    投票集中的几秒内，每个房间每个窗口只发一条消息，而不是每张票一条。
+    """
+
+    def __init__(self, window_ms=BROADCAST_COALESCE_WINDOW_MS):
+        self.window = window_ms / 1000
+        self._lock = threading.Lock()
+        self._buffers = {}  # (房间, 事件) -> {"items": OrderedDict, "build": fn, "merge": fn}
+        self._events = {}  # 事件 -> 统计
+        self.max_depth = 0
+
+    def submit(self, room, event, items, build, merge=None):
+        """items: [(key, 条目)]；build(条目列表) -> 消息内容"""
+        if self.window <= 0:
+            self._emit(room, event, build([item for _, item in items]))
+            with self._lock:
+                self._count(event, submitted=len(items), emitted=1)
+            return
+
+        with self._lock:
+            buffer = self._buffers.get((room, event))
+            first = buffer is None
+            if first:
+                buffer = self._buffers[(room, event)] = {"items": OrderedDict(), "build": build, "merge": merge}
+            superseded = 0
+            for key, item in items:
+                old = buffer["items"].pop(key, None)
+                if old is not None:
+                    superseded += 1
+                    if buffer["merge"]:
+                        item = buffer["merge"](old, item)
+                buffer["items"][key] = item
+            self._count(event, submitted=len(items), superseded=superseded)
+            self.max_depth = max(self.max_depth, len(buffer["items"]))
+
+        if first:
+            socketio.start_background_task(self._flush_later, room, event)
+
+    def _flush_later(self, room, event):
+        socketio.sleep(self.window)
+        self.flush(room, event)
+
+    def flush(self, room, event):
+        with self._lock:
+            buffer = self._buffers.pop((room, event), None)
+        if not buffer or not buffer["items"]:
+            return
+        try:
+            payload = buffer["build"](list(buffer["items"].values()))
+        except Exception as e:
+            print(f"[WARN] 合并推送 {event} 失败: {e}")
+            return
+        self._emit(room, event, payload)
+        with self._lock:
+            self._count(event, emitted=1)
+
+    def _emit(self, room, event, payload):
+        try:
+            socketio.emit(event, payload, room=room)
+        except Exception as e:
+            print(f"[WARN] 广播 {event} 失败: {e}")
+
+    def _count(self, event, submitted=0, superseded=0, emitted=0):
+        entry = self._events.setdefault(event, {"submitted": 0, "superseded": 0, "emitted": 0})
+        entry["submitted"] += submitted
+        entry["superseded"] += superseded
+        entry["emitted"] += emitted
+
+    def stats(self):
+        with self._lock:
+            depths = [len(b["items"]) for b in self._buffers.values()]
+            events = {name: dict(entry) for name, entry in self._events.items()}
+        return {
+            "window_ms": round(self.window * 1000),
+            "pending_buffers": len(depths),
+            "queue_depth": sum(depths),
+            "max_queue_depth": self.max_depth,
+            "events": events,
+        }
+
+
+broadcast_coalescer = BroadcastCoalescer()
+
+def session_room(session_id):
+    """会期的 Socket.IO 房间名，页面通过 join_session 事件加入"""
+    return f"session:{session_id}"
+
+def session_payload(session_id, payload):
+    return dict(payload, session_id=session_id, timestamp=datetime.now(UTC).isoformat() + "Z")
+
+def broadcast_to_session(session_id, event, payload):
+    """写入成功后向会期房间广播；推送失败不影响接口结果（页面仍有轮询兜底）"""
     try:
-        target_db["submissions"].create_index([("country_id", 1), ("session_id", 1)], unique=True, name="uniq_country_session")
-    except Exception:
-        pass
+        socketio.emit(event, session_payload(session_id, payload), room=session_room(session_id))
+    except Exception as e:
+        print(f"[WARN] 广播 {event} 失败: {e}")
+
+def merge_vote_delta(old, new):
+    """同一格的投票在窗口内被覆盖：保留最新结果，记下被覆盖的序列号"""
+    return dict(new, superseded=old.get("superseded", []) + [old["seq"]])
+
+def build_vote_payload(deltas):
+    """合并后的投票变更：{epoch, seq, deltas, superseded, window_ms}。
+    deltas 只含每格最后一次写入，superseded 为被同一格后续投票覆盖以及未写入（skipped）的序列号，
+    客户端把两者合起来检查序列是否连续。各工作进程分别合并，多进程时不同进程的序列号交错，
+    客户端按 window_ms（合并窗口）暂存不连续的批次，等其他进程的批次补齐后再应用；
+    同一国家的投票另附 country_id 与 {file_id: vote_result}，单票时保留与 vote_update 中继一致的字段"""
+    epoch = deltas[-1]["epoch"]
+    # 窗口内 epoch 变化（变更记录被重建）时只保留新 epoch 的记录，客户端会据此重新同步
+    deltas = sorted((d for d in deltas if d["epoch"] == epoch), key=lambda d: d["seq"])
+    last_seq = deltas[-1]["seq"]
+    skipped = [d["seq"] for d in deltas if d.get("skipped")]
+    deltas = [d for d in deltas if not d.get("skipped")]
+    payload = {
+        "epoch": epoch,
+        "seq": last_seq,
+        "deltas": [{k: v for k, v in d.items() if k not in ("epoch", "superseded")} for d in deltas],
+        "superseded": sorted([seq for d in deltas for seq in d.get("superseded", [])] + skipped),
+        "window_ms": BROADCAST_COALESCE_WINDOW_MS
+    }
+    countries = {d.get("country_id") for d in deltas}
+    if len(countries) == 1 and not any(d.get("resync") for d in deltas):
+        payload["country_id"] = countries.pop()
+        payload["votes"] = {d["file_id"]: d["result"] for d in deltas}
+        if len(deltas) == 1:
+            payload["file_id"] = deltas[0]["file_id"]
+            payload["vote_result"] = deltas[0]["result"]
+    return payload
+
+def broadcast_vote_changes(session_id, change):
+    """投票写入后推送 vote_status_changed，窗口期内的多次投票合并为一条。
+    change 为 vote_changes.write_votes() 返回的变更记录：
+    {"epoch", "seq", "deltas": [{seq, country_id, file_id, result} 或 {seq, skipped} / {seq, resync}]}"""
+    items = []
+    for delta in change["deltas"]:
+        if delta.get("resync") or delta.get("skipped"):
+            key = ("resync" if delta.get("resync") else "skipped", delta["seq"])
+        else:
+            key = (delta["country_id"], delta["file_id"])
+        items.append((key, dict(delta, epoch=change["epoch"])))
+    broadcast_coalescer.submit(
+        session_room(session_id), "vote_status_changed", items,
+        build=lambda deltas: session_payload(session_id, build_vote_payload(deltas)),
+        merge=merge_vote_delta
+    )
+
+def build_rollcall_payload(session_id, changes):
+    """合并后的点名变更，附带发出时的点名统计，页面无需再请求 /api/rollcall/statistics；
+    单个国家时保留与 rollcall_update 中继一致的字段"""
+    try:
+        statistics = rollcall_statistics(session_id)
+    except Exception as e:
+        print(f"[WARN] 点名统计失败，推送不附带统计: {e}")
+        statistics = None
+    payload = {
+        "country_ids": [c["country_id"] for c in changes],
+        "changes": changes,
+        "statistics": statistics
+    }
+    if len(changes) == 1:
+        payload.update(changes[0])
+    return session_payload(session_id, payload)
+
+def broadcast_rollcall_changes(session_id, arrivals):
+    """点名写入后推送 rollcall_status_changed。
+    arrivals 为 [(country_id, arrived)]，批量更新以及窗口期内的多次更新合并为一个事件，同一国家以最后一次为准"""
+    items = [
+        (country_id, {"country_id": country_id, "status": "present" if arrived else "absent"})
+        for country_id, arrived in arrivals
+    ]
+    if not items:
+        return
+    broadcast_coalescer.submit(
+        session_room(session_id), "rollcall_status_changed", items,
+        build=lambda changes: build_rollcall_payload(session_id, changes)
+    )
+
+# =========================
+# 在线状态
+# =========================
+# 客户端每 PRESENCE_HEARTBEAT_INTERVAL 秒发送一次 presence_heartbeat；
+# 超过 PRESENCE_TIMEOUT 秒没有心跳的连接视为离线（断线事件丢失时的兜底）
+PRESENCE_HEARTBEAT_INTERVAL = int(os.getenv('PRESENCE_HEARTBEAT_INTERVAL', 30))
+PRESENCE_TIMEOUT = int(os.getenv('PRESENCE_TIMEOUT', 120))
+
+class PresenceRegistry:
+    """本进程 Socket.IO 连接的在线登记：房间 -> {sid: {sid, user_id, country_id, role, last_heartbeat}}。
+    由 connect / join / leave / disconnect 维护，心跳超时的连接在下一次 sweep 时移除。
+    只记录连接到本进程的客户端；多进程部署时各进程分别统计（Nginx 按 ip_hash 粘滞）。
+    """
+
+    def __init__(self, timeout=PRESENCE_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._rooms = {}  # room -> {sid: entry}
+        self._connections = {}  # sid -> {"rooms": set, "last_heartbeat": float}
+        self._last_sweep = 0.0
+        self.expired = 0
+
+    def connect(self, sid):
+        with self._lock:
+            self._connections[sid] = {"rooms": set(), "last_heartbeat": time.time()}
+
+    def join(self, room, sid, user_id=None, country_id=None, role=None):
+        """登记连接加入房间，返回在线条目；重复加入时更新身份信息"""
+        now = time.time()
+        with self._lock:
+            conn = self._connections.setdefault(sid, {"rooms": set(), "last_heartbeat": now})
+            conn["rooms"].add(room)
+            conn["last_heartbeat"] = now
+            entry = {
+                "sid": sid,
+                "user_id": user_id,
+                "country_id": country_id,
+                "role": role,
+                "last_heartbeat": now
+            }
+            self._rooms.setdefault(room, {})[sid] = entry
+            return dict(entry)
+
+    def leave(self, room, sid):
+        """移出房间，返回被移除的条目（不在房间中时返回 None）"""
+        with self._lock:
+            conn = self._connections.get(sid)
+            if conn:
+                conn["rooms"].discard(room)
+            return self._remove(room, sid)
+
+    def disconnect(self, sid):
+        """连接断开，返回 [(房间, 条目)]"""
+        with self._lock:
+            conn = self._connections.pop(sid, None)
+            if not conn:
+                return []
+            removed = [(room, self._remove(room, sid)) for room in conn["rooms"]]
+            return [(room, entry) for room, entry in removed if entry]
+
+    def heartbeat(self, sid):
+        """刷新连接的心跳时间，返回连接是否仍在登记中"""
+        now = time.time()
+        with self._lock:
+            conn = self._connections.get(sid)
+            if not conn:
+                return False
+            conn["last_heartbeat"] = now
+            for room in conn["rooms"]:
+                entry = self._rooms.get(room, {}).get(sid)
+                if entry:
+                    entry["last_heartbeat"] = now
+            return True
+
+    def sweep(self, min_interval=None):
+        """移除心跳超时的连接，返回 [(房间, 条目)]。
+        min_interval 秒内已清理过则直接返回，便于在高频路径上顺带调用"""
+        now = time.time()
+        with self._lock:
+            if min_interval and now - self._last_sweep < min_interval:
+                return []
+            self._last_sweep = now
+            deadline = now - self.timeout
+            stale = [sid for sid, conn in self._connections.items() if conn["last_heartbeat"] < deadline]
+            removed = []
+            for sid in stale:
+                conn = self._connections.pop(sid)
+                for room in conn["rooms"]:
+                    entry = self._remove(room, sid)
+                    if entry:
+                        removed.append((room, entry))
+            self.expired += len(stale)
+            return removed
+
+    def members(self, room):
+        with self._lock:
+            return [dict(entry) for entry in self._rooms.get(room, {}).values()]
+
+    def count(self, room):
+        with self._lock:
+            return len(self._rooms.get(room, {}))
+
+    def _remove(self, room, sid):
+        members = self._rooms.get(room)
+        if not members:
+            return None
+        entry = members.pop(sid, None)
+        if not members:
+            del self._rooms[room]
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                "connections": len(self._connections),
+                "rooms": len(self._rooms),
+                "members": sum(len(m) for m in self._rooms.values()),
+                "expired": self.expired,
+                "timeout": self.timeout,
+                "heartbeat_interval": PRESENCE_HEARTBEAT_INTERVAL
+            }
+
+
+presence = PresenceRegistry()
+
+def presence_view(entry):
+    """在线条目 -> 接口/推送格式，心跳时间转为 ISO 字符串"""
+    return dict(entry, last_heartbeat=datetime.fromtimestamp(entry["last_heartbeat"], UTC).isoformat() + "Z")
+
+def build_presence_payload(room, changes):
+    return {
+        "room_id": room,
+        "joined": [presence_view(entry) for kind, entry in changes if kind == "joined"],
+        "left": [presence_view(entry) for kind, entry in changes if kind == "left"],
+        "count": presence.count(room),
+        "timestamp": datetime.now(UTC).isoformat() + "Z"
+    }
+
+def broadcast_presence(room, joined=(), left=()):
+    """向房间推送在线变化 presence_changed：{room_id, joined: [...], left: [...], count}。
+    窗口期内的变化合并为一条，同一连接以最后一次变化为准"""
+    items = [(e["sid"], ("joined", e)) for e in joined] + [(e["sid"], ("left", e)) for e in left]
+    if not items:
+        return
+    broadcast_coalescer.submit(room, "presence_changed", items,
+                               build=lambda changes: build_presence_payload(room, changes))
+
+def broadcast_presence_removals(removed):
+    """按房间合并推送 disconnect / sweep 移除的条目"""
+    by_room = defaultdict(list)
+    for room, entry in removed:
+        by_room[room].append(entry)
+    for room, entries in by_room.items():
+        broadcast_presence(room, left=entries)
+
+def sweep_presence():
+    """顺带清理心跳超时的连接（每个心跳周期最多执行一次）"""
+    broadcast_presence_removals(presence.sweep(min_interval=PRESENCE_HEARTBEAT_INTERVAL))
+
+# =========================
+# 投票变更序列
+# =========================
+# 每个会期可增量补齐的最近变更条数；客户端落后更多时改为下发快照
+VOTE_CHANGE_RETENTION = int(os.getenv('VOTE_CHANGE_RETENTION', 1000))
+# 预留序列号到变更记录落库的最长等待（秒）：比已落库超过该时长的记录更早的缺口视为写入中断
+VOTE_CHANGE_COMMIT_GRACE = float(os.getenv('VOTE_CHANGE_COMMIT_GRACE', 10))
+
+class VoteChangeLog:
+    """file_vote_details 按会期的变更序列。
+    序列号即 resource_versions 中 file_votes 的版本号（同时用作 ETag），单调递增；
+    投票写入前先分配序列号，序列号与 epoch 随投票写入同一次更新（change_seq / change_epoch），
+    并以"已存序列号更小或属于旧 epoch"为条件，同一格的并发写入因此按序列号决定最终结果。
+    每次写入在会期库的 file_vote_changes 集合追加 {epoch, seq, country_id, file_id, result}，
+    resource_versions 记录被清除后序列号从 1 重新计数，旧 epoch 的记录不会与之冲突或被当作新变更；
+    未写入的条目（被更新的序列号抢先、写入失败）追加 {seq, skipped} 占位，保持序列连续。
+    无法逐条描述的批量修改（如强制结束时补弃权）追加一条 resync 记录，
+    跨过它的客户端改为重新拉取快照。过期记录由 TTL 索引清理，不在写入路径上删除。
+    """
+    COLLECTION = "file_vote_changes"
+    RESOURCE = "file_votes"
+    SEQ_FIELD = "change_seq"
+    EPOCH_FIELD = "change_epoch"
+
+    def __init__(self, retention=VOTE_CHANGE_RETENTION):
+        self.retention = retention
+
+    def _collection(self, session_id):
+        return get_cols_by_session(session_id)["db"][self.COLLECTION]
+
+    def _append(self, session_id, version, deltas):
+        created_at = datetime.now(UTC)
+        self._collection(session_id).insert_many([
+            dict(d, session_id=session_id, epoch=version["epoch"], created_at=created_at) for d in deltas
+        ])
+        return {"epoch": version["epoch"], "seq": version["version"], "deltas": deltas}
+
+    def write_votes(self, session_id, collection, items):
+        """items 为 [(filter, vote_record)]，vote_record 含 country_id / file_id / vote_result。
+        以 bulk_upsert 写入 collection 并记录变更，返回 (bulk_upsert 结果, 变更记录)，
+        变更记录为 {"epoch", "seq", "deltas"}，items 为空时为 None"""
+        if not items:
+            return bulk_upsert(collection, []), None
+        version = resource_versions.bump(session_id, self.RESOURCE, len(items))
+        first = version["version"] - len(items) + 1
+        stamped, guards = [], []
+        for i, (flt, doc) in enumerate(items):
+            seq = first + i
+            stamped.append((flt, dict(doc, **{self.SEQ_FIELD: seq, self.EPOCH_FIELD: version["epoch"]})))
+            guards.append({"$or": [
+                {self.EPOCH_FIELD: {"$ne": version["epoch"]}},
+                {self.SEQ_FIELD: {"$lt": seq}}
+            ]})
+        result = bulk_upsert(collection, stamped, guards)
+
+        deltas = []
+        for (_, doc), outcome in zip(stamped, result["outcomes"]):
+            if outcome in ("upserted", "modified"):
+                deltas.append({"seq": doc[self.SEQ_FIELD], "country_id": doc["country_id"],
+                               "file_id": doc["file_id"], "result": doc["vote_result"]})
+            else:
+                deltas.append({"seq": doc[self.SEQ_FIELD], "skipped": True})
+        return result, self._append(session_id, version, deltas)
+
+    def record_resync(self, session_id):
+        version = resource_versions.bump(session_id, self.RESOURCE)
+        return self._append(session_id, version, [{"seq": version["version"], "resync": True}])
+
+    def committed(self, session_id):
+        """返回 {"epoch", "seq"}，seq 为投票已全部写入的最高序列号。
+        序列号在写入投票前预留，current() 可能领先于尚未写完的投票；变更记录在投票写入后追加，
+        因此取最近 retention 条中第一个缺口之前的序列号。缺口之上已有落库超过
+        VOTE_CHANGE_COMMIT_GRACE 秒的记录时，该缺口视为写入中断（或已被 TTL 清理），不再等待"""
+        version = resource_versions.current(session_id, self.RESOURCE)
+        if not version:
+            return {"epoch": None, "seq": 0}
+        top = version["version"]
+        rows = list(self._collection(session_id).find(
+            {"session_id": session_id, "epoch": version["epoch"], "seq": {"$gt": top - self.retention, "$lte": top}},
+            {"_id": 0, "seq": 1, "created_at": 1}
+        ))
+        settled_before = datetime.now(UTC) - timedelta(seconds=VOTE_CHANGE_COMMIT_GRACE)
+        present = {row["seq"] for row in rows}
+        floor = max([max(0, top - self.retention)] + [
+            row["seq"] for row in rows
+            if row.get("created_at") and row["created_at"].replace(tzinfo=UTC) < settled_before
+        ])
+        seq = floor
+        while seq < top and (seq + 1) in present:
+            seq += 1
+        return {"epoch": version["epoch"], "seq": seq}
+
+    def since(self, session_id, seq, epoch=None):
+        """返回 {"epoch", "seq", "changes"}；seq 过旧、epoch 不符或区间内有 resync 时 changes 为 None"""
+        version = resource_versions.current(session_id, self.RESOURCE) or {"epoch": None, "version": 0}
+        result = {"epoch": version["epoch"], "seq": version["version"], "changes": None}
+        if seq is None or (epoch and epoch != version["epoch"]):
+            return result
+        if seq > version["version"] or seq < version["version"] - self.retention:
+            return result
+        changes = list(self._collection(session_id).find(
+            {"session_id": session_id, "epoch": version["epoch"], "seq": {"$gt": seq, "$lte": version["version"]}},
+            {"_id": 0, "session_id": 0, "epoch": 0, "created_at": 0}
+        ).sort("seq", 1))
+        # 条数不符说明有写入尚未落到变更集合，或记录已过期
+        if len(changes) == version["version"] - seq and not any(c.get("resync") for c in changes):
+            result["changes"] = changes
+        return result
+
+
+vote_changes = VoteChangeLog()
+
+# =========================
+# 投票统计
+# =========================
+VOTE_CHOICES = ("agree", "disagree", "abstain")
+
+def tally_votes(cols, session_id, include_matrix=False):
+    """在服务端按 (file_id, vote_result) 聚合 file_vote_details。
+
+    返回 {"files": {file_id: {"agree", "disagree", "abstain", "voters"}},
+          "voted_countries": [...]}。
+    同一国家对同一文件若有多条记录只取最后投出的一条（按 voted_at），
+    因此 voters 即该文件的去重投票国家数。结果大小只与文件数相关，不随投票记录数增长。
+    include_matrix=True 时在同一次聚合中按国家分组，另返回存档用的
+    "vote_matrix": {country_id: {file_id: vote_result}}。
+    """
+    collection = cols["file_vote_details"]
+    tally_stage = [{"$group": {
+        "_id": {"file_id": "$_id.file_id", "vote_result": "$vote_result"},
+        "count": {"$sum": 1}
+    }}]
+    pipeline = [
+        {"$match": {"session_id": session_id, "vote_result": {"$in": list(VOTE_CHOICES)}}},
+        {"$sort": {"voted_at": 1}},
+        {"$group": {
+            "_id": {"file_id": "$file_id", "country_id": "$country_id"},
+            "vote_result": {"$last": "$vote_result"}
+        }},
+    ]
+    vote_matrix = None
+    if include_matrix:
+        pipeline.append({"$facet": {
+            "tally": tally_stage,
+            "matrix": [
+                {"$match": {"_id.file_id": {"$nin": [None, ""]}, "_id.country_id": {"$nin": [None, ""]}}},
+                {"$group": {
+                    "_id": "$_id.country_id",
+                    "votes": {"$push": {"k": "$_id.file_id", "v": "$vote_result"}}
+                }},
+                {"$project": {"votes": {"$arrayToObject": "$votes"}}},
+            ],
+        }})
+        facets = next(collection.aggregate(pipeline), {"tally": [], "matrix": []})
+        rows = facets["tally"]
+        vote_matrix = {row["_id"]: row["votes"] for row in facets["matrix"]}
+    else:
+        rows = collection.aggregate(pipeline + tally_stage)
+
+    files = {}
+    for row in rows:
+        file_id = row["_id"].get("file_id")
+        if not file_id:
+            continue
+        counts = files.setdefault(file_id, {"agree": 0, "disagree": 0, "abstain": 0, "voters": 0})
+        counts[row["_id"]["vote_result"]] = row["count"]
+        counts["voters"] += row["count"]
+
+    voted_countries = [c for c in collection.distinct(
+        "country_id", {"session_id": session_id, "vote_result": {"$in": list(VOTE_CHOICES)}}
+    ) if c]
+    result = {"files": files, "voted_countries": voted_countries}
+    if include_matrix:
+        result["vote_matrix"] = vote_matrix
+    return result
+
+def tally_vote_matrix(vote_matrix):
+    """按前端提交的投票矩阵统计（数据库中没有投票记录时的兼容路径）"""
+    files = {}
+    for country_votes in vote_matrix.values():
+        for file_id, vote_result in country_votes.items():
+            if vote_result in VOTE_CHOICES:
+                counts = files.setdefault(file_id, {"agree": 0, "disagree": 0, "abstain": 0, "voters": 0})
+                counts[vote_result] += 1
+                counts["voters"] += 1
+    return files
+
+def is_file_passed(counts):
+    """同意票多于反对票即通过"""
+    return counts["agree"] > counts["disagree"]
+
+FILE_METADATA_FIELDS = ("file_id", "saved_name", "file_name", "original_name", "country_id")
+
+def resolve_file_metadata(cols, session_id, file_ids):
+    """批量解析文件元数据，查询次数与文件数量无关。
+
+    解析顺序与原先逐个文件查询一致：
+    1. temp_files  2. vote_files
+    3. file_vote_details 反查 country_id，再取该国家的 submission
+    4. submission 的 _id 中包含 file_id
+    每个集合只执行一次 $in 查询（submissions 按会期读取一次），
+    返回 {file_id: {"file_name", "original_name", "country_id", "source"}}，
+    找不到的文件不出现在结果中。
+    """
+    pending = set(file_ids)
+    resolved = {}
+    if not pending:
+        return resolved
+
+    projection = list_projection(FILE_METADATA_FIELDS)
+    for source in ("temp_files", "vote_files"):
+        if not pending:
+            break
+        for doc in cols["db"][source].find(
+            {"session_id": session_id, "file_id": {"$in": list(pending)}}, projection
+        ):
+            file_id = doc.get("file_id")
+            if file_id not in pending:
+                continue
+            file_name = doc.get("saved_name") or doc.get("file_name", "")
+            resolved[file_id] = {
+                "file_name": file_name,
+                "original_name": doc.get("original_name", file_name),
+                "country_id": doc.get("country_id", ""),
+                "source": source,
+            }
+            pending.discard(file_id)
+
+    if not pending:
+        return resolved
+
+    submissions = list(cols["submissions"].find(
+        {"session_id": session_id}, {"country_id": 1, "file_name": 1}
+    ))
+    submission_by_country = {}
+    for sub in submissions:
+        submission_by_country.setdefault(sub.get("country_id"), sub)
+
+    voter_by_file = {
+        row["_id"]: row.get("country_id")
+        for row in cols["db"]["file_vote_details"].aggregate([
+            {"$match": {"session_id": session_id, "file_id": {"$in": list(pending)}}},
+            {"$group": {"_id": "$file_id", "country_id": {"$first": "$country_id"}}},
+        ])
+    }
+
+    for file_id in list(pending):
+        submission = None
+        country_id = voter_by_file.get(file_id)
+        if country_id:
+            submission = submission_by_country.get(country_id)
+            source = "file_vote_details"
+        if not submission:
+            submission = next(
+                (sub for sub in submissions if sub.get("file_name") and file_id in str(sub.get("_id", ""))),
+                None
+            )
+            source = "submissions"
+            if submission:
+                country_id = submission.get("country_id", "")
+        if submission:
+            resolved[file_id] = {
+                "file_name": submission.get("file_name", ""),
+                "original_name": submission.get("file_name", ""),
+                "country_id": country_id,
+                "source": source,
+            }
+            pending.discard(file_id)
+
+    return resolved
+
+def save_passed_files(cols, session_id, passed_records, submission_updates):
+    """通过文件的写入合并为两次批量写入，次数与文件数量无关：
+    passed_records 按 (session_id, file_id) upsert 到 passed_files；
+    submission_updates 为 [(country_id, 字段)]，按顺序标记对应 submission 为通过（不新建）。"""
+    if passed_records:
+        result = bulk_upsert(cols["db"]["passed_files"], [
+            ({"session_id": session_id, "file_id": record["file_id"]}, record) for record in passed_records
+        ])
+        for err in result["errors"]:
+            print(f"  ❌ 保存passed_files失败: {err['message']}")
+    if submission_updates:
+        # 同一国家有多个通过文件时以最后一个为准，因此按顺序执行
+        cols["submissions"].bulk_write([
+            UpdateOne({"session_id": session_id, "country_id": country_id}, {"$set": fields}, upsert=False)
+            for country_id, fields in submission_updates
+        ], ordered=True)
 
 # =========================
 # 用户认证API
@@ -366,19 +2045,14 @@ def api_save_country_selection():
                     'message': '缺少必要参数'
                 }), 400
 
-            session_info = col_settings.find_one({"session_id": session_id})
+            session_info = meeting_settings.get(session_id)
             if not session_info:
                 return jsonify({
                     'code': 404,
                     'message': '会议不存在'
                 }), 404
 
-            exists = col_settings.find_one({
-                "session_id": session_id,
-                "participants.country_id": country_id
-            })
-
-            if exists:
+            if meeting_settings.has_participant(session_id, country_id):
                 return jsonify({
                     'code': 200,
                     'message': '该国家已经加入会议'
@@ -407,31 +2081,19 @@ def api_save_country_selection():
                 'message': '缺少必要参数'
             }), 400
         
-        # 检查会议是否存在（全局集合）
-        session_info = col_settings.find_one({"session_id": session_id})
-        print(f"查找会议(全局): {session_info}")
+        # 检查会议是否存在
+        session_info = meeting_settings.get(session_id)
+        print(f"查找会议: {session_info}")
         
         if not session_info:
-            # 兜底：尝试从会期专属库同步一份到全局集合
-            synced = ensure_session_in_global(session_id)
-            if synced:
-                session_info = col_settings.find_one({"session_id": session_id})
-                print(f"同步后查找会议(全局): {session_info}")
-            else:
-                print("会议不存在（全局与专属库均未找到）")
-                return jsonify({
-                    'code': 404,
-                    'message': '会议不存在'
-                }), 404
+            print("会议不存在")
+            return jsonify({
+                'code': 404,
+                'message': '会议不存在'
+            }), 404
         
         # 检查是否已经存在相同的国家选择
-        existing_participant = col_settings.find_one({
-            "session_id": session_id,
-            "participants.country_id": country_id
-        })
-        print(f"检查现有参与国: {existing_participant}")
-        
-        if existing_participant:
+        if meeting_settings.has_participant(session_id, country_id):
             print("该国家已经加入会议")
             return jsonify({
                 'code': 409,
@@ -448,24 +2110,29 @@ def api_save_country_selection():
         }
         print(f"准备保存参与国数据: {participant_data}")
         
-        result = col_settings.update_one(
-            {"session_id": session_id},
-            {
-                "$push": {
-                    "participants": participant_data
-                }
-            }
-        )
+        result = meeting_settings.add_participant(session_id, participant_data)
         
         print(f"更新结果: matched_count={result.matched_count}, modified_count={result.modified_count}")
         
         if result.matched_count == 0:
+            # 条件更新未命中：并发请求已加入该国，或会议已被删除
+            if meeting_settings.has_participant(session_id, country_id):
+                return jsonify({
+                    'code': 409,
+                    'message': '该国家已经加入会议'
+                }), 409
             print("会议不存在，无法更新")
             return jsonify({
                 'code': 404,
                 'message': '会议不存在'
             }), 404
         
+        # 主席端选择页按此增量追加参与国，无需轮询
+        broadcast_to_session(session_id, "participant_joined", {
+            "participant": participant_data,
+            "country": participant_view(participant_data)
+        })
+        
         return jsonify({
             'code': 200,
             'message': '国家选择已保存',
@@ -498,7 +2165,7 @@ def api_get_meeting_participants():
             }), 400
         
         # 获取会议信息
-        session_info = col_settings.find_one({"session_id": session_id})
+        session_info = meeting_settings.get(session_id)
         if not session_info:
             return jsonify({
                 'code': 404,
@@ -508,11 +2175,11 @@ def api_get_meeting_participants():
         # 获取参与国列表
         participants = session_info.get('participants', [])
         
-        return jsonify({
+        return etag_response(meeting_settings.etag(session_info), lambda: jsonify({
             'code': 200,
             'message': '获取参与国列表成功',
             'data': participants
-        })
+        }))
         
     except Exception as e:
         print(f"获取参与国列表失败: {e}")
@@ -619,6 +2286,25 @@ def api_list_rooms():
             "message": f"获取房间列表失败: {str(e)}"
         }), 500
 
+@app.route('/api/rooms/<path:room_id>/presence', methods=['GET'])
+def api_room_presence(room_id):
+    """房间在线列表，只读本进程的在线登记，不访问数据库。
+    会期推送房间的 room_id 为 session:<会期号>，也可用 ?session_id= 指定"""
+    session_id = request.args.get('session_id')
+    if session_id:
+        room_id = session_room(session_id)
+    sweep_presence()
+    members = [presence_view(e) for e in presence.members(room_id)]
+    return jsonify({
+        "code": 200,
+        "data": {
+            "room_id": room_id,
+            "count": len(members),
+            "members": members,
+            "pid": os.getpid()
+        }
+    })
+
 @app.route('/api/rooms/join', methods=['POST'])
 @jwt_required()
 def api_join_room():
@@ -873,9 +2559,8 @@ def api_extend_vote_deadline():
                 "message": "请提供新的截止时间"
             }), 400
         
-        cols = get_cols_by_session(session_id)
-        cols["settings"].update_one(
-            {"session_id": session_id},
+        meeting_settings.update(
+            session_id,
             {"$set": {"vote_deadline": new_deadline}},
             upsert=True
         )
@@ -919,38 +2604,18 @@ def api_force_end_voting():
                 "forced_end": True
             }}
         )
+        if result.modified_count:
+            broadcast_vote_changes(session_id, vote_changes.record_resync(session_id))
 
         print(f"✅ 已标记 {result.modified_count} 个未完成投票为弃权")
 
-        # 步骤2: 构建投票矩阵
-        print(f"\n📋 步骤2: 构建投票矩阵")
-        vote_matrix = {}
-        file_vote_details = list(cols["db"]["file_vote_details"].find({"session_id": session_id}))
-
-        for vote in file_vote_details:
-            country_id = vote.get("country_id")
-            file_id = vote.get("file_id")
-            vote_result = vote.get("vote_result")
-
-            if country_id and file_id and vote_result:
-                if country_id not in vote_matrix:
-                    vote_matrix[country_id] = {}
-                vote_matrix[country_id][file_id] = vote_result
-
-        print(f"📊 投票矩阵构建完成，包含 {len(vote_matrix)} 个国家，{len(file_vote_details)} 个投票记录")
-
-        # 步骤3: 计算每个文件的投票结果
-        print(f"\n📋 步骤3: 计算文件投票结果")
-        file_results = {}
-        for vote in file_vote_details:
-            file_id = vote.get("file_id")
-            vote_result = vote.get("vote_result")
-
-            if file_id and vote_result:
-                if file_id not in file_results:
-                    file_results[file_id] = {'agree': 0, 'disagree': 0, 'abstain': 0}
-                file_results[file_id][vote_result] += 1
+        # 步骤2-3: 同一次聚合中统计每个文件的投票结果并构建存档用的投票矩阵
+        print(f"\n📋 步骤2: 统计投票结果并构建投票矩阵")
+        tally = tally_votes(cols, session_id, include_matrix=True)
+        vote_matrix = tally["vote_matrix"]
+        file_results = tally["files"]
 
+        print(f"📊 投票矩阵构建完成，包含 {len(vote_matrix)} 个国家")
         print(f"📈 计算完成，共处理 {len(file_results)} 个文件的投票结果")
 
         # 步骤4: 保存投票完成记录
@@ -972,60 +2637,23 @@ def api_force_end_voting():
         # 步骤5: 处理通过的文件，保存到passed_files集合和submissions集合
         print(f"\n📋 步骤5: 处理通过的文件")
         passed_files_list = []
+        passed_records = []
+        submission_updates = []
+        file_metadata = resolve_file_metadata(
+            cols, session_id, [fid for fid, res in file_results.items() if is_file_passed(res)]
+        )
         for file_id, results in file_results.items():
             # 判断是否通过（同意票 > 反对票）
-            is_passed = results['agree'] > results['disagree']
-
-            if is_passed:
+            if is_file_passed(results):
                 print(f"🔍 处理通过的文件: file_id={file_id}")
 
-                # 多种方式获取文件信息
-                file_info = None
-                country_id = None
-                file_name = None
-                original_name = None
-
-                # 方法1: 从temp_files获取
-                temp_file = cols["db"]["temp_files"].find_one({"file_id": file_id, "session_id": session_id})
-                if temp_file:
-                    print(f"  ✅ 从temp_files找到文件信息")
-                    file_info = temp_file
-                    file_name = temp_file.get("saved_name") or temp_file.get("file_name", "")
-                    original_name = temp_file.get("original_name", file_name)
-                    country_id = temp_file.get("country_id", "")
-
-                # 方法2: 从vote_files获取
-                if not file_info:
-                    vote_file = cols["db"]["vote_files"].find_one({"file_id": file_id, "session_id": session_id})
-                    if vote_file:
-                        print(f"  ✅ 从vote_files找到文件信息")
-                        file_info = vote_file
-                        file_name = vote_file.get("saved_name") or vote_file.get("file_name", "")
-                        original_name = vote_file.get("original_name", file_name)
-                        country_id = vote_file.get("country_id", "")
-
-                # 方法3: 从file_vote_details反查country_id，再从submissions获取
-                if not file_info:
-                    print(f"  ⚠️  temp_files和vote_files都没找到，尝试从file_vote_details反查...")
-                    vote_detail = cols["db"]["file_vote_details"].find_one({
-                        "file_id": file_id,
-                        "session_id": session_id
-                    })
-                    if vote_detail:
-                        country_id = vote_detail.get("country_id", "")
-                        print(f"  🔍 从file_vote_details找到country_id: {country_id}")
-
-                        # 从submissions获取文件信息
-                        if country_id:
-                            submission = cols["submissions"].find_one({
-                                "session_id": session_id,
-                                "country_id": country_id
-                            })
-                            if submission:
-                                print(f"  ✅ 从submissions找到文件信息")
-                                file_name = submission.get("file_name", "")
-                                original_name = file_name
-                                file_info = submission
+                # 从批量解析结果中获取文件信息
+                file_info = file_metadata.get(file_id)
+                file_name = file_info["file_name"] if file_info else None
+                original_name = file_info["original_name"] if file_info else None
+                country_id = file_info["country_id"] if file_info else None
+                if file_info:
+                    print(f"  ✅ 从{file_info['source']}找到文件信息")
 
                 # 如果找到了文件信息，保存到passed_files
                 if file_info and file_name:
@@ -1046,30 +2674,19 @@ def api_force_end_voting():
                         "status": "passed",
                         "force_passed": True
                     }
-
-                    cols["db"]["passed_files"].update_one(
-                        {"session_id": session_id, "file_id": file_id},
-                        {"$set": passed_file_record},
-                        upsert=True
-                    )
-                    print(f"  💾 已保存到passed_files集合")
+                    passed_records.append(passed_file_record)
 
                     # 同时更新submissions集合，标记为通过
                     if country_id:
-                        cols["submissions"].update_one(
-                            {"session_id": session_id, "country_id": country_id},
-                            {"$set": {
-                                "vote_passed": True,
-                                "vote_status": "passed",
-                                "vote_agree_count": results['agree'],
-                                "vote_disagree_count": results['disagree'],
-                                "vote_abstain_count": results['abstain'],
-                                "vote_completed_at": completed_at,
-                                "force_passed": True
-                            }},
-                            upsert=False
-                        )
-                        print(f"  💾 已更新submissions集合")
+                        submission_updates.append((country_id, {
+                            "vote_passed": True,
+                            "vote_status": "passed",
+                            "vote_agree_count": results['agree'],
+                            "vote_disagree_count": results['disagree'],
+                            "vote_abstain_count": results['abstain'],
+                            "vote_completed_at": completed_at,
+                            "force_passed": True
+                        }))
 
                     passed_files_list.append({
                         "file_id": file_id,
@@ -1084,12 +2701,14 @@ def api_force_end_voting():
                     print(f"  ❌ 警告：无法找到file_id={file_id}的文件信息！")
                     print(f"     同意票: {results['agree']}, 反对票: {results['disagree']}")
 
+        save_passed_files(cols, session_id, passed_records, submission_updates)
+        print(f"  💾 已保存到passed_files集合并更新submissions集合")
         print(f"📋 投票完成，共有 {len(passed_files_list)} 个文件通过（强制结束）")
 
         # 步骤6: 更新会议状态为宣言阶段
         print(f"\n📋 步骤6: 更新会议状态为宣言阶段")
-        cols["settings"].update_one(
-            {"session_id": session_id},
+        meeting_settings.update(
+            session_id,
             {"$set": {
                 "meeting_phase": "declaration",
                 "voting_completed": True,
@@ -1141,14 +2760,9 @@ def api_finalize_file_voting():
         
         cols = get_cols_by_session(session_id)
         
-        # 计算每个文件的投票结果
-        file_results = {}
-        for country_id, country_votes in vote_matrix.items():
-            for file_id, vote_result in country_votes.items():
-                if vote_result is not None:
-                    if file_id not in file_results:
-                        file_results[file_id] = {'agree': 0, 'disagree': 0, 'abstain': 0}
-                    file_results[file_id][vote_result] += 1
+        # 计算每个文件的投票结果：以数据库中的投票记录为准，
+        # 没有记录时（旧客户端）退回按提交的投票矩阵统计
+        file_results = tally_votes(cols, session_id)["files"] or tally_vote_matrix(vote_matrix)
         
         # 保存投票完成记录
         voting_record = {
@@ -1163,75 +2777,24 @@ def api_finalize_file_voting():
         
         # 【新增】处理通过的文件，保存到passed_files集合和submissions集合
         passed_files_list = []
+        passed_records = []
+        submission_updates = []
+        file_metadata = resolve_file_metadata(
+            cols, session_id, [fid for fid, res in file_results.items() if is_file_passed(res)]
+        )
         for file_id, results in file_results.items():
             # 判断是否通过（同意票 > 反对票）
-            is_passed = results['agree'] > results['disagree']
-            
-            if is_passed:
+            if is_file_passed(results):
                 print(f"\n🔍 处理通过的文件: file_id={file_id}")
                 
-                # 【改进】多种方式获取文件信息
-                file_info = None
-                country_id = None
-                file_name = None
-                original_name = None
-                
-                # 方法1: 从temp_files获取
-                temp_file = cols["db"]["temp_files"].find_one({"file_id": file_id, "session_id": session_id})
-                if temp_file:
-                    print(f"  ✅ 从temp_files找到文件信息")
-                    file_info = temp_file
-                    file_name = temp_file.get("saved_name") or temp_file.get("file_name", "")
-                    original_name = temp_file.get("original_name", file_name)
-                    country_id = temp_file.get("country_id", "")
-                
-                # 方法2: 从vote_files获取
-                if not file_info:
-                    vote_file = cols["db"]["vote_files"].find_one({"file_id": file_id, "session_id": session_id})
-                    if vote_file:
-                        print(f"  ✅ 从vote_files找到文件信息")
-                        file_info = vote_file
-                        file_name = vote_file.get("saved_name") or vote_file.get("file_name", "")
-                        original_name = vote_file.get("original_name", file_name)
-                        country_id = vote_file.get("country_id", "")
-                
-                # 方法3: 从file_vote_details反查country_id，再从submissions获取
-                if not file_info:
-                    print(f"  ⚠️  temp_files和vote_files都没找到，尝试从file_vote_details反查...")
-                    vote_detail = cols["db"]["file_vote_details"].find_one({
-                        "file_id": file_id, 
-                        "session_id": session_id
-                    })
-                    if vote_detail:
-                        country_id = vote_detail.get("country_id", "")
-                        print(f"  🔍 从file_vote_details找到country_id: {country_id}")
-                        
-                        # 从submissions获取文件信息
-                        if country_id:
-                            submission = cols["submissions"].find_one({
-                                "session_id": session_id,
-                                "country_id": country_id
-                            })
-                            if submission:
-                                print(f"  ✅ 从submissions找到文件信息")
-                                file_name = submission.get("file_name", "")
-                                original_name = file_name
-                                file_info = submission
-                
-                # 方法4: 遍历所有submissions，找到匹配的文件
-                if not file_info:
-                    print(f"  ⚠️  尝试遍历submissions查找...")
-                    all_submissions = cols["submissions"].find({"session_id": session_id})
-                    for sub in all_submissions:
-                        # 如果文件名中包含file_id，或者其他匹配逻辑
-                        if sub.get("file_name") and file_id in str(sub.get("_id", "")):
-                            print(f"  ✅ 在submissions中找到匹配文件")
-                            file_name = sub.get("file_name", "")
-                            original_name = file_name
-                            country_id = sub.get("country_id", "")
-                            file_info = sub
-                            break
-                
+                # 从批量解析结果中获取文件信息
+                file_info = file_metadata.get(file_id)
+                file_name = file_info["file_name"] if file_info else None
+                original_name = file_info["original_name"] if file_info else None
+                country_id = file_info["country_id"] if file_info else None
+                if file_info:
+                    print(f"  ✅ 从{file_info['source']}找到文件信息")
+
                 # 如果找到了文件信息，保存到passed_files
                 if file_info and file_name:
                     print(f"  📄 文件名: {file_name}")
@@ -1250,29 +2813,18 @@ def api_finalize_file_voting():
                         "passed_at": completed_at,
                         "status": "passed"
                     }
-                    
-                    cols["db"]["passed_files"].update_one(
-                        {"session_id": session_id, "file_id": file_id},
-                        {"$set": passed_file_record},
-                        upsert=True
-                    )
-                    print(f"  💾 已保存到passed_files集合")
+                    passed_records.append(passed_file_record)
                     
                     # 同时更新submissions集合，标记为通过
                     if country_id:
-                        cols["submissions"].update_one(
-                            {"session_id": session_id, "country_id": country_id},
-                            {"$set": {
-                                "vote_passed": True,
-                                "vote_status": "passed",
-                                "vote_agree_count": results['agree'],
-                                "vote_disagree_count": results['disagree'],
-                                "vote_abstain_count": results['abstain'],
-                                "vote_completed_at": completed_at
-                            }},
-                            upsert=False
-                        )
-                        print(f"  💾 已更新submissions集合")
+                        submission_updates.append((country_id, {
+                            "vote_passed": True,
+                            "vote_status": "passed",
+                            "vote_agree_count": results['agree'],
+                            "vote_disagree_count": results['disagree'],
+                            "vote_abstain_count": results['abstain'],
+                            "vote_completed_at": completed_at
+                        }))
                     
                     passed_files_list.append({
                         "file_id": file_id,
@@ -1287,6 +2839,7 @@ def api_finalize_file_voting():
                     print(f"     同意票: {results['agree']}, 反对票: {results['disagree']}")
                     print(f"     请检查temp_files、vote_files或submissions集合中是否有此文件")
         
+        save_passed_files(cols, session_id, passed_records, submission_updates)
         print(f"📋 投票完成，共有 {len(passed_files_list)} 个文件通过")
         
         return jsonify({
@@ -1321,27 +2874,16 @@ def api_rebuild_passed_files():
         
         cols = get_cols_by_session(session_id)
         
-        # 1. 从file_vote_details获取所有投票记录
-        vote_details = list(cols["db"]["file_vote_details"].find({"session_id": session_id}))
-        print(f"\n📊 找到 {len(vote_details)} 条投票记录")
+        # 1-2. 基于file_vote_details在服务端统计每个文件的投票结果
+        file_results = tally_votes(cols, session_id)["files"]
+        print(f"\n📊 找到 {len(file_results)} 个文件的投票记录")
         
-        if not vote_details:
+        if not file_results:
             return jsonify({
                 "code": 400,
                 "message": "没有找到投票记录"
             }), 400
         
-        # 2. 统计每个文件的投票结果
-        file_results = {}
-        for vote in vote_details:
-            file_id = vote.get("file_id")
-            vote_result = vote.get("vote_result")
-            
-            if file_id and vote_result:
-                if file_id not in file_results:
-                    file_results[file_id] = {'agree': 0, 'disagree': 0, 'abstain': 0, 'country_id': vote.get("country_id")}
-                file_results[file_id][vote_result] += 1
-        
         print(f"\n📈 投票统计：")
         for file_id, results in file_results.items():
             print(f"  {file_id}: 同意={results['agree']}, 反对={results['disagree']}, 弃权={results['abstain']}")
@@ -1349,49 +2891,49 @@ def api_rebuild_passed_files():
         # 3. 判断哪些文件通过，并保存到passed_files
         passed_count = 0
         passed_files_list = []
+        passed_records = []
+        submission_updates = []
+        rebuilt_at = datetime.now(UTC).isoformat() + "Z"
+        
+        # 通过文件的投票国家、vote_files、temp_files、submissions 各用一次 $in 查询批量读取
+        passed_ids = [fid for fid, res in file_results.items() if is_file_passed(res)]
+        voter_by_file = {
+            row["_id"]: row.get("country_id") or ""
+            for row in cols["db"]["file_vote_details"].aggregate([
+                {"$match": {"session_id": session_id, "file_id": {"$in": passed_ids}}},
+                {"$group": {"_id": "$file_id", "country_id": {"$first": "$country_id"}}},
+            ])
+        }
+        owner_by_file = {}
+        for source in ("vote_files", "temp_files"):
+            for doc in cols["db"][source].find(
+                {"session_id": session_id, "file_id": {"$in": passed_ids}}, {"file_id": 1, "country_id": 1}
+            ):
+                owner_by_file.setdefault(source, {}).setdefault(doc.get("file_id"), doc.get("country_id", ""))
+        candidate_countries = set(voter_by_file.values())
+        for owners in owner_by_file.values():
+            candidate_countries.update(owners.values())
+        submission_by_country = {}
+        for sub in cols["submissions"].find(
+            {"session_id": session_id, "country_id": {"$in": [c for c in candidate_countries if c]}}
+        ):
+            submission_by_country.setdefault(sub.get("country_id"), sub)
         
         for file_id, results in file_results.items():
-            is_passed = results['agree'] > results['disagree']
-            
-            if is_passed:
+            if is_file_passed(results):
                 print(f"\n✅ 文件 {file_id} 通过投票")
                 
-                # 获取country_id
-                country_id = results.get('country_id', '')
-                
-                # 从submissions获取文件信息
-                submission = None
-                if country_id:
-                    submission = cols["submissions"].find_one({
-                        "session_id": session_id,
-                        "country_id": country_id
-                    })
-                
-                # 如果没找到，尝试从vote_files获取
-                if not submission:
-                    vote_file = cols["db"]["vote_files"].find_one({
-                        "file_id": file_id,
-                        "session_id": session_id
-                    })
-                    if vote_file:
-                        country_id = vote_file.get("country_id", "")
-                        submission = cols["submissions"].find_one({
-                            "session_id": session_id,
-                            "country_id": country_id
-                        })
+                # 获取country_id（取该文件的任一投票记录），从submissions获取文件信息
+                country_id = voter_by_file.get(file_id, "")
+                submission = submission_by_country.get(country_id) if country_id else None
                 
-                # 如果还没找到，尝试从temp_files获取
-                if not submission:
-                    temp_file = cols["db"]["temp_files"].find_one({
-                        "file_id": file_id,
-                        "session_id": session_id
-                    })
-                    if temp_file:
-                        country_id = temp_file.get("country_id", "")
-                        submission = cols["submissions"].find_one({
-                            "session_id": session_id,
-                            "country_id": country_id
-                        })
+                # 如果没找到，依次尝试从vote_files、temp_files获取
+                for source in ("vote_files", "temp_files"):
+                    if submission:
+                        break
+                    if file_id in owner_by_file.get(source, {}):
+                        country_id = owner_by_file[source][file_id]
+                        submission = submission_by_country.get(country_id)
                 
                 if submission:
                     file_name = submission.get("file_name", "")
@@ -1410,29 +2952,20 @@ def api_rebuild_passed_files():
                         "vote_agree": results['agree'],
                         "vote_disagree": results['disagree'],
                         "vote_abstain": results['abstain'],
-                        "passed_at": datetime.now(UTC).isoformat() + "Z",
+                        "passed_at": rebuilt_at,
                         "status": "passed"
                     }
-                    
-                    cols["db"]["passed_files"].update_one(
-                        {"session_id": session_id, "file_id": file_id},
-                        {"$set": passed_file_record},
-                        upsert=True
-                    )
+                    passed_records.append(passed_file_record)
                     
                     # 更新submissions集合
-                    cols["submissions"].update_one(
-                        {"session_id": session_id, "country_id": country_id},
-                        {"$set": {
-                            "vote_passed": True,
-                            "vote_status": "passed",
-                            "vote_agree_count": results['agree'],
-                            "vote_disagree_count": results['disagree'],
-                            "vote_abstain_count": results['abstain'],
-                            "vote_completed_at": datetime.now(UTC).isoformat() + "Z"
-                        }},
-                        upsert=False
-                    )
+                    submission_updates.append((country_id, {
+                        "vote_passed": True,
+                        "vote_status": "passed",
+                        "vote_agree_count": results['agree'],
+                        "vote_disagree_count": results['disagree'],
+                        "vote_abstain_count": results['abstain'],
+                        "vote_completed_at": rebuilt_at
+                    }))
                     
                     passed_count += 1
                     passed_files_list.append({
@@ -1441,10 +2974,12 @@ def api_rebuild_passed_files():
                         "country_id": country_id
                     })
                     
-                    print(f"  💾 已保存到passed_files")
                 else:
                     print(f"  ⚠️  警告：找不到对应的submission记录")
         
+        save_passed_files(cols, session_id, passed_records, submission_updates)
+        print(f"  💾 已保存到passed_files")
+        
         print(f"\n{'='*60}")
         print(f"✅ 重建完成！共有 {passed_count} 个文件通过")
         print(f"{'='*60}")
@@ -1483,10 +3018,8 @@ def api_create_new_session():
                 "message": "会议编号不能为空"
             }), 400
         
-        cols = get_cols_by_session(session_id)
-        
         # 检查会议是否已存在
-        existing_session = cols["settings"].find_one({"session_id": session_id})
+        existing_session = meeting_settings.get(session_id)
         if existing_session:
             return jsonify({
                 "code": 409,
@@ -1534,42 +3067,10 @@ def api_create_new_session():
             }
         }
         
-        # 保存到数据库（会期专属库）
-        cols["settings"].insert_one(session_record)
-
-        # 同步写入全局会议设置集合，供跨设备加入和国家保存使用
-        try:
-            # 若全局集合中已存在则不重复写入
-            existing_global = col_settings.find_one({"session_id": session_id})
-            if not existing_global:
-                col_settings.insert_one({
-                    "session_id": session_id,
-                    "committee_name": committee_name,
-                    "agenda": agenda,
-                    "created_by": created_by,
-                    "created_at": datetime.now(UTC).isoformat() + "Z",
-                    "status": "active",
-                    "participants": [],
-                    "meeting_state": session_record.get("meeting_state", {}),
-                    "chairman_controls": session_record.get("chairman_controls", {}),
-                })
-            else:
-                # 轻量更新基本信息，避免被旧数据覆盖
-                col_settings.update_one(
-                    {"session_id": session_id},
-                    {"$set": {
-                        "committee_name": committee_name,
-                        "agenda": agenda,
-                        "status": "active"
-                    }}
-                )
-        except Exception as e:
-            # 不阻断会议创建流程，但记录日志便于排查
-            print(f"同步写入全局会议设置失败: {e}")
+        # 保存到数据库（唯一权威存储，跨设备加入和国家保存都读取这里）
+        meeting_settings.create(session_id, session_record)
         
-        # 如果是五位数会议编号，确保创建独立数据库的索引
-        if session_id and len(session_id) == 5 and session_id.isdigit():
-            ensure_indexes(cols["db"])
+        # 独立数据库的索引已由 get_cols_by_session 在首次使用时创建
         
         return jsonify({
             "code": 200,
@@ -1751,38 +3252,8 @@ def country_motion_page():
     motion_country = request.args.get("motion_country", "")
     motion_text = request.args.get("motion_text", "")
     
-    # 获取国家国旗 - 根据国家名称匹配国旗文件
-    country_flag_url = "/static/flags/default.png"
-    if country_name:
-        try:
-            # 国家名称到国旗文件的映射
-            country_flag_map = {
-                '中国': 'cn.png', '美国': 'us.png', '日本': 'jp.png', 
-                '德国': 'de.png', '法国': 'fr.png', '英国': 'uk.png',
-                '俄罗斯': 'ru.png', '印度': 'in.png', '巴西': 'br.png',
-                '加拿大': 'ca.png', '澳大利亚': 'au.png', '韩国': 'kr.png',
-                '意大利': 'it.png', '西班牙': 'es.png', '荷兰': 'nl.png',
-                '瑞典': 'se.png', '挪威': 'no.png', '丹麦': 'dk.png',
-                '芬兰': 'fi.png', '瑞士': 'ch.png', '奥地利': 'at.png',
-                '比利时': 'be.png', '波兰': 'pl.png', '捷克': 'cz.png',
-                '匈牙利': 'hu.png', '葡萄牙': 'pt.png', '希腊': 'gr.png',
-                '土耳其': 'tr.png', '以色列': 'il.png', '沙特阿拉伯': 'sa.png',
-                '阿联酋': 'ae.png', '埃及': 'eg.png', '南非': 'za.png',
-                '尼日利亚': 'ng.png', '肯尼亚': 'ke.png', '摩洛哥': 'ma.png',
-                '阿根廷': 'ar.png', '智利': 'cl.png', '墨西哥': 'mx.png',
-                '哥伦比亚': 'co.png', '秘鲁': 'pe.png', '委内瑞拉': 've.png',
-                '泰国': 'th.png', '马来西亚': 'my.png', '新加坡': 'sg.png',
-                '印度尼西亚': 'id.png', '菲律宾': 'ph.png', '越南': 'vn.png',
-                '新西兰': 'nz.png', '乌拉圭': 'uy.png'
-            }
-            
-            flag_filename = country_flag_map.get(country_name)
-            if flag_filename:
-                flag_path = os.path.join('app', 'static', 'flags', flag_filename)
-                if os.path.exists(flag_path):
-                    country_flag_url = f"/static/flags/{flag_filename}"
-        except:
-            pass  # 如果查询失败，使用默认国旗
+    # 获取国家国旗（国家索引 + 国旗清单）
+    country_flag_url, _ = resolve_country_flag(country_id, country_name)
     
     return render_template('country_motion.html',
                          session_id=session_id,
@@ -1805,38 +3276,8 @@ def country_file_vote_page():
     mechanism_name = request.args.get("mechanism_name", "协商一致")
     mechanism_requirement = request.args.get("mechanism_requirement", "要求：100% 同意")
     
-    # 获取国家国旗 - 根据国家名称匹配国旗文件
-    country_flag_url = "/static/flags/default.png"
-    if country_name:
-        try:
-            # 国家名称到国旗文件的映射
-            country_flag_map = {
-                '中国': 'cn.png', '美国': 'us.png', '日本': 'jp.png', 
-                '德国': 'de.png', '法国': 'fr.png', '英国': 'uk.png',
-                '俄罗斯': 'ru.png', '印度': 'in.png', '巴西': 'br.png',
-                '加拿大': 'ca.png', '澳大利亚': 'au.png', '韩国': 'kr.png',
-                '意大利': 'it.png', '西班牙': 'es.png', '荷兰': 'nl.png',
-                '瑞典': 'se.png', '挪威': 'no.png', '丹麦': 'dk.png',
-                '芬兰': 'fi.png', '瑞士': 'ch.png', '奥地利': 'at.png',
-                '比利时': 'be.png', '波兰': 'pl.png', '捷克': 'cz.png',
-                '匈牙利': 'hu.png', '葡萄牙': 'pt.png', '希腊': 'gr.png',
-                '土耳其': 'tr.png', '以色列': 'il.png', '沙特阿拉伯': 'sa.png',
-                '阿联酋': 'ae.png', '埃及': 'eg.png', '南非': 'za.png',
-                '尼日利亚': 'ng.png', '肯尼亚': 'ke.png', '摩洛哥': 'ma.png',
-                '阿根廷': 'ar.png', '智利': 'cl.png', '墨西哥': 'mx.png',
-                '哥伦比亚': 'co.png', '秘鲁': 'pe.png', '委内瑞拉': 've.png',
-                '泰国': 'th.png', '马来西亚': 'my.png', '新加坡': 'sg.png',
-                '印度尼西亚': 'id.png', '菲律宾': 'ph.png', '越南': 'vn.png',
-                '新西兰': 'nz.png', '乌拉圭': 'uy.png'
-            }
-            
-            flag_filename = country_flag_map.get(country_name)
-            if flag_filename:
-                flag_path = os.path.join('app', 'static', 'flags', flag_filename)
-                if os.path.exists(flag_path):
-                    country_flag_url = f"/static/flags/{flag_filename}"
-        except:
-            pass  # 如果查询失败，使用默认国旗
+    # 获取国家国旗（国家索引 + 国旗清单）
+    country_flag_url, _ = resolve_country_flag(country_id, country_name)
     
     return render_template('country_file_vote.html',
                          session_id=session_id,
@@ -1859,20 +3300,7 @@ def country_declaration_page():
     declaration_time = request.args.get("declaration_time", "")
     
     # 获取国家国旗和emoji
-    country_flag_url = "/static/flags/default.png"
-    country_flag_emoji = "🏳️"
-    if country_name:
-        country_flag_map = {
-            '德国': '/static/flags/de.png', '法国': '/static/flags/fr.png',
-            '美国': '/static/flags/us.png', '中国': '/static/flags/cn.png',
-            '日本': '/static/flags/jp.png', '英国': '/static/flags/uk.png'
-        }
-        country_emoji_map = {
-            '德国': '🇩🇪', '法国': '🇫🇷', '美国': '🇺🇸', 
-            '中国': '🇨🇳', '日本': '🇯🇵', '英国': '🇬🇧'
-        }
-        country_flag_url = country_flag_map.get(country_name, "/static/flags/default.png")
-        country_flag_emoji = country_emoji_map.get(country_name, "🏳️")
+    country_flag_url, country_flag_emoji = resolve_country_flag(country_id, country_name)
     
     return render_template('country_declaration.html',
                          session_id=session_id,
@@ -1978,15 +3406,15 @@ def api_cast_file_vote():
             "voted_at": datetime.now(UTC).isoformat() + "Z"
         }
         
-        cols["db"]["file_vote_details"].update_one(
+        _, change = vote_changes.write_votes(session_id, cols["db"]["file_vote_details"], [(
             {
                 "session_id": session_id,
                 "country_id": country_id,
                 "file_id": file_id
             },
-            {"$set": vote_record},
-            upsert=True
-        )
+            vote_record
+        )])
+        broadcast_vote_changes(session_id, change)
         
         return jsonify({
             "code": 200,
@@ -2013,7 +3441,8 @@ def api_submit_country_votes():
         # 同时保存到两个集合，确保主席监控页面能读取到数据
         current_time = datetime.now(UTC).isoformat() + "Z"
 
-        # 1. 保存到 file_vote_details 集合（主席监控页面读取的数据源）
+        # 1. 保存到 file_vote_details 集合（主席监控页面读取的数据源），一次批量写入
+        vote_items = []
         for file_id, vote_result in votes.items():
             vote_record = {
                 "session_id": session_id,
@@ -2022,16 +3451,16 @@ def api_submit_country_votes():
                 "vote_result": vote_result,
                 "voted_at": current_time
             }
-
-            cols["db"]["file_vote_details"].update_one(
+            vote_items.append((
                 {
                     "session_id": session_id,
                     "country_id": country_id,
                     "file_id": file_id
                 },
-                {"$set": vote_record},
-                upsert=True
-            )
+                vote_record
+            ))
+
+        bulk_result, change = vote_changes.write_votes(session_id, cols["db"]["file_vote_details"], vote_items)
 
         # 2. 保存到 country_vote_submissions 集合（用于记录提交状态）
         completion_record = {
@@ -2047,10 +3476,16 @@ def api_submit_country_votes():
             {"$set": completion_record},
             upsert=True
         )
+        if change:
+            broadcast_vote_changes(session_id, change)
 
         return jsonify({
             "code": 200,
-            "message": "所有投票已提交"
+            "message": "所有投票已提交",
+            "data": {
+                "counts": bulk_result["counts"],
+                "errors": bulk_result["errors"]
+            }
         })
 
     except Exception as e:
@@ -2225,9 +3660,8 @@ def api_extend_submission_deadline():
             }), 400
         
         # 保存新的截止时间到数据库
-        cols = get_cols_by_session(session_id)
-        cols["settings"].update_one(
-            {"session_id": session_id},
+        meeting_settings.update(
+            session_id,
             {"$set": {"submission_deadline": new_deadline}},
             upsert=True
         )
@@ -2260,34 +3694,190 @@ def chairman_motion_page():
 # =========================
 # 动议管理相关API
 # =========================
+# 发言计时器以状态机保存在 speaking_orders.timer_state 中：
+#   status   idle / running / paused
+#   duration 本次发言总时长（秒，含延时）
+#   elapsed  此前各段运行累计用时（暂停偏移）
+#   started_at 本段开始运行的服务器时间戳（仅 running 时有值）
+#   version  每次状态变化递增，客户端据此忽略重复推送；写库时以它做乐观并发控制
+# 只有开始、暂停、继续、重置、延时等状态变化才写库并推送，倒计时由客户端本地计算。
+# 下发的状态只含绝对时间（deadline），与响应时刻无关，可以按版本号做 ETag 缓存；
+# 服务器当前时间另由 X-Server-Time 响应头或推送中的 server_now 给出，供客户端校正时钟。
+DEFAULT_SPEAKING_TIME = 300
+SPEAKING_TIMER_ACTIONS = ("start", "pause", "resume", "reset", "extend")
+# 参数上限：单次发言总时长（含延时，秒）与发言者序号，超出时返回 400
+MAX_SPEAKING_TIME = 24 * 3600
+MAX_SPEAKER_INDEX = 10000
+# 并发操作导致版本冲突时的重试次数，仍冲突则返回 409
+SPEAKING_TIMER_RETRIES = 3
+
+def new_timer_state(duration=DEFAULT_SPEAKING_TIME, speaker=-1, version=0):
+    return {
+        "status": "idle",
+        "speaker": speaker,
+        "duration": duration,
+        "elapsed": 0,
+        "started_at": None,
+        "version": version,
+    }
+
+def timer_view(state):
+    """下发给页面的计时器状态，只由状态本身决定：
+    remaining 为本段开始运行前的剩余秒数（非 running 时即当前剩余），
+    running 时 deadline 为结束的服务器时间戳，客户端按校正后的时钟本地倒计时"""
+    status = state.get("status", "idle")
+    duration = state.get("duration", DEFAULT_SPEAKING_TIME)
+    remaining = max(0.0, duration - state.get("elapsed", 0))
+    deadline = None
+    if status == "running" and state.get("started_at"):
+        deadline = round(state["started_at"] + remaining, 3)
+    return {
+        "status": status,
+        "speaker": state.get("speaker", -1),
+        "duration": duration,
+        "remaining": round(remaining, 3),
+        "deadline": deadline,
+        "version": state.get("version", 0),
+    }
+
+def timer_int_param(data, key, default, minimum, maximum):
+    """读取计时器的整数参数：未提供时取 default，否则必须是 [minimum, maximum] 内的整数"""
+    if key not in data:
+        return default
+    value = data[key]
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{key} 必须是整数")
+    try:
+        value = int(value)
+    except (ValueError, OverflowError):
+        # OverflowError：1e400 等无穷大的浮点数
+        raise ValueError(f"{key} 必须是整数")
+    if value < minimum:
+        raise ValueError(f"{key} 不能小于 {minimum}")
+    if value > maximum:
+        raise ValueError(f"{key} 不能大于 {maximum}")
+    return value
+
+def apply_timer_action(state, action, data, now):
+    """计时器状态转换，返回新状态；无效转换原样返回（版本号不变）。
+    参数非法时抛出 ValueError"""
+    state = dict(state)
+    if action == "start":
+        # 为指定发言者从头开始计时
+        state = new_timer_state(
+            duration=timer_int_param(data, "duration", 0, 0, MAX_SPEAKING_TIME) or DEFAULT_SPEAKING_TIME,
+            speaker=timer_int_param(data, "speaker", state.get("speaker", -1), -1, MAX_SPEAKER_INDEX),
+            version=state.get("version", 0)
+        )
+        state.update(status="running", started_at=now)
+    elif action == "pause" and state.get("status") == "running":
+        state.update(status="paused", elapsed=state.get("elapsed", 0) + now - state["started_at"], started_at=None)
+    elif action == "resume" and state.get("status") == "paused":
+        state.update(status="running", started_at=now)
+    elif action == "reset":
+        state = new_timer_state(
+            duration=timer_int_param(data, "duration", 0, 0, MAX_SPEAKING_TIME) or state.get("duration", DEFAULT_SPEAKING_TIME),
+            speaker=state.get("speaker", -1),
+            version=state.get("version", 0)
+        )
+    elif action == "extend":
+        duration = state.get("duration", DEFAULT_SPEAKING_TIME) + timer_int_param(data, "seconds", 60, 1, MAX_SPEAKING_TIME)
+        if duration > MAX_SPEAKING_TIME:
+            raise ValueError(f"延时后的发言时长不能超过 {MAX_SPEAKING_TIME} 秒")
+        state["duration"] = duration
+    else:
+        return state
+    state["version"] = state.get("version", 0) + 1
+    return state
+
+@app.route('/api/speaking_timer', methods=['POST'])
+def api_speaking_timer():
+    """主席端计时器操作：start（需 speaker、duration）/ pause / resume / reset / extend（seconds）。
+    按读取到的 timer_state.version 条件更新，多个主席端标签页并发操作时冲突方重读后重试"""
+    try:
+        data = request.get_json() or {}
+        session_id = data.get("session_id", "default")
+        action = data.get("action")
+        if action not in SPEAKING_TIMER_ACTIONS:
+            return jsonify({"code": 400, "message": "无效的计时器操作"}), 400
+
+        cols = get_cols_by_session(session_id)
+        speaking_orders = cols["db"]["speaking_orders"]
+        for _ in range(SPEAKING_TIMER_RETRIES):
+            doc = speaking_orders.find_one({"session_id": session_id}, {"timer_state": 1})
+            state = (doc or {}).get("timer_state") or new_timer_state()
+            now = time.time()
+            try:
+                new_state = apply_timer_action(state, action, data, now)
+            except ValueError as e:
+                return jsonify({"code": 400, "message": f"计时器参数无效: {str(e)}"}), 400
+
+            if new_state["version"] == state.get("version", 0):
+                break
+
+            update = {"timer_state": new_state, "updated_at": datetime.now(UTC).isoformat() + "Z"}
+            if action == "start":
+                update["current_speaker"] = new_state["speaker"]
+            # 条件更新：文档不存在时插入（唯一索引保证只有一方成功），
+            # 否则要求 timer_state 仍是读取时的版本
+            if doc is None:
+                flt = {"session_id": session_id}
+            elif doc.get("timer_state"):
+                flt = {"session_id": session_id, "timer_state.version": state.get("version", 0)}
+            else:
+                flt = {"session_id": session_id, "timer_state": None}
+            try:
+                result = speaking_orders.update_one(
+                    flt,
+                    {"$set": update, "$setOnInsert": {"session_id": session_id}},
+                    upsert=doc is None
+                )
+            except DuplicateKeyError:
+                continue
+            if doc is None or result.matched_count:
+                resource_versions.bump(session_id, "speaking_order")
+                broadcast_to_session(session_id, "speaking_timer_changed", {
+                    "timer": timer_view(new_state),
+                    "server_now": round(time.time(), 3)
+                })
+                break
+        else:
+            return jsonify({"code": 409, "message": "计时器正被其他操作修改，请重试"}), 409
+
+        return jsonify({
+            "code": 200,
+            "message": "计时器已更新",
+            "data": timer_view(new_state),
+            "server_now": round(time.time(), 3)
+        })
+
+    except Exception as e:
+        return jsonify({
+            "code": 500,
+            "message": f"更新计时器失败: {str(e)}"
+        }), 500
 
 @app.route('/api/save_speaking_order', methods=['POST'])
 def api_save_speaking_order():
-    """保存发言顺序和实时状态"""
+    """保存发言顺序和当前发言者（计时器状态由 /api/speaking_timer 维护）"""
     try:
         data = request.get_json()
         session_id = data.get("session_id", "default")
         speaking_order = data.get("speaking_order", [])
         current_speaker = data.get("current_speaker", -1)
-        is_timer_running = data.get("is_timer_running", False)
-        current_timer = data.get("current_timer", 0)
         
         print(f"\n📥 [后端API] 收到保存请求:")
         print(f"  - session_id: {session_id}")
         print(f"  - current_speaker: {current_speaker}")
-        print(f"  - is_timer_running: {is_timer_running}")
-        print(f"  - current_timer: {current_timer}")
         print(f"  - speaking_order 数量: {len(speaking_order)}")
         
         cols = get_cols_by_session(session_id)
         
-        # 保存发言顺序和计时器状态到数据库
+        # 保存发言顺序到数据库
         speaking_order_record = {
             "session_id": session_id,
             "speaking_order": speaking_order,
             "current_speaker": current_speaker,
-            "is_timer_running": is_timer_running,
-            "current_timer": current_timer,
             "updated_at": datetime.now(UTC).isoformat() + "Z"
         }
         
@@ -2296,6 +3886,11 @@ def api_save_speaking_order():
             {"$set": speaking_order_record},
             upsert=True
         )
+        resource_versions.bump(session_id, "speaking_order")
+        broadcast_to_session(session_id, "speaking_order_changed", {
+            "speaking_order": speaking_order,
+            "current_speaker": current_speaker
+        })
         
         print(f"💾 [数据库] 保存结果: matched={result.matched_count}, modified={result.modified_count}, upserted_id={result.upserted_id}")
         
@@ -2320,6 +3915,10 @@ def api_get_speaking_order():
         
         print(f"\n📤 [后端API] 收到获取请求: session_id={session_id}")
         
+        etag = f"speaking-order-{resource_versions.tag(session_id, 'speaking_order')}"
+        if etag_matches(etag):
+            return with_server_time(etag_response(etag, None))
+        
         speaking_order_doc = cols["db"]["speaking_orders"].find_one({"session_id": session_id})
         
         if speaking_order_doc:
@@ -2327,10 +3926,11 @@ def api_get_speaking_order():
             speaking_order = speaking_order_doc.get("speaking_order", [])
             current_speaker = speaking_order_doc.get("current_speaker", -1)
             
-            # 添加实时状态信息
-            timer_state = speaking_order_doc.get("timer_state", {})
-            is_timer_running = speaking_order_doc.get("is_timer_running", False)
-            current_timer = speaking_order_doc.get("current_timer", 0)
+            # 计时器状态只含绝对时间，响应体不随时间变化，可按版本号缓存；
+            # 兼容字段 current_timer 为最近一次状态变化时的剩余秒数
+            timer_state = timer_view(speaking_order_doc.get("timer_state") or new_timer_state())
+            is_timer_running = timer_state["status"] == "running"
+            current_timer = math.ceil(timer_state["remaining"])
             
             print(f"📦 [数据库] 读取到数据:")
             print(f"  - current_speaker: {current_speaker}")
@@ -2352,19 +3952,20 @@ def api_get_speaking_order():
             }
             
             print(f"✅ [后端API] 返回数据成功")
-            return jsonify(response_data)
+            return with_server_time(etag_response(etag, lambda: jsonify(response_data)))
         else:
             print(f"⚠️ [数据库] 未找到 session_id={session_id} 的数据")
-            return jsonify({
+            return with_server_time(etag_response(etag, lambda: jsonify({
                 "code": 200,
                 "message": "暂无发言顺序",
                 "data": {
                     "speaking_order": [],
                     "current_speaker": -1,
                     "is_timer_running": False,
-                    "current_timer": 0
+                    "current_timer": 0,
+                    "timer_state": timer_view(new_timer_state())
                 }
-            })
+            })))
         
     except Exception as e:
         print(f"❌ [后端API] 获取失败: {str(e)}")
@@ -2476,7 +4077,7 @@ def motion_page():
     country_name = request.args.get("country_name", "未知国家")
 
     # 获取会议设置
-    sdoc = cols["settings"].find_one({"session_id": session_id}) or {}
+    sdoc = meeting_settings.get(session_id) or {}
     committee = sdoc.get("committee_name", " ")
     agenda = sdoc.get("agenda", " ")
 
@@ -2506,12 +4107,11 @@ def motion_page():
 def vote_page():
     """投票页面 / 与会国文件投票页面"""
     session_id = request.args.get("session_id", "default")
-    cols = get_cols_by_session(session_id)
     country_id = request.args.get("country_id", "")
     country_name = request.args.get("country_name", "未知国家")
 
     # 获取会议设置
-    sdoc = cols["settings"].find_one({"session_id": session_id}) or {}
+    sdoc = meeting_settings.get(session_id) or {}
     committee = sdoc.get("committee_name", " ")
     agenda = sdoc.get("agenda", " ")
 
@@ -2528,10 +4128,9 @@ def vote_page():
 def file_vote_page():
     """文件投票页面"""
     session_id = request.args.get("session_id", "default")
-    cols = get_cols_by_session(session_id)
     
     # 获取会议设置
-    sdoc = cols["settings"].find_one({"session_id": session_id}) or {}
+    sdoc = meeting_settings.get(session_id) or {}
     committee = sdoc.get("committee_name", "WTO委员会")
     agenda = sdoc.get("agenda", "贸易谈判")
     
@@ -2546,10 +4145,9 @@ def file_vote_page():
 def comprehensive_vote_page():
     """全面投票页面 - 每个国家对每个文件进行投票"""
     session_id = request.args.get("session_id", "default")
-    cols = get_cols_by_session(session_id)
     
     # 获取会议设置
-    sdoc = cols["settings"].find_one({"session_id": session_id}) or {}
+    sdoc = meeting_settings.get(session_id) or {}
     committee = sdoc.get("committee_name", "WTO委员会")
     agenda = sdoc.get("agenda", "贸易谈判")
     
@@ -2564,10 +4162,9 @@ def comprehensive_vote_page():
 def simple_vote_page():
     """简化投票页面 - 更简单可靠的投票界面"""
     session_id = request.args.get("session_id", "default")
-    cols = get_cols_by_session(session_id)
     
     # 获取会议设置
-    sdoc = cols["settings"].find_one({"session_id": session_id}) or {}
+    sdoc = meeting_settings.get(session_id) or {}
     committee = sdoc.get("committee_name", "WTO委员会")
     agenda = sdoc.get("agenda", "贸易谈判")
     
@@ -2582,10 +4179,9 @@ def simple_vote_page():
 def ultra_simple_vote_page():
     """超简单投票页面 - 最可靠的投票界面"""
     session_id = request.args.get("session_id", "default")
-    cols = get_cols_by_session(session_id)
     
     # 获取会议设置
-    sdoc = cols["settings"].find_one({"session_id": session_id}) or {}
+    sdoc = meeting_settings.get(session_id) or {}
     committee = sdoc.get("committee_name", " ")
     agenda = sdoc.get("agenda", " ")
     
@@ -2600,6 +4196,14 @@ def ultra_simple_vote_page():
 # =========================
 # API：国家列表（你原有的接口，保持不变）
 # =========================
+def participant_view(participant):
+    """参与国记录 -> 主席端国家列表项 {id, name, flag_url}"""
+    return {
+        "id": participant.get('country_id'),
+        "name": participant.get('country_name', '未知国家'),
+        "flag_url": participant.get('country_flag', '/static/flags/default.png')
+    }
+
 @app.route('/api/countries')
 def get_countries():
     """
@@ -2610,52 +4214,47 @@ def get_countries():
     session_id = request.args.get("session_id")
     only_participants = request.args.get("only_participants", "false").lower() == "true"
     
-    cols = get_cols_by_session(session_id or "default")
-    
     # 如果需要只返回参与国，则从 meeting_settings 获取已保存的参与国列表
     participants_data = []
     if only_participants and session_id:
-        session_info = col_settings.find_one({"session_id": session_id})
+        session_info = meeting_settings.get(session_id)
         if session_info and session_info.get('participants'):
             # participants 是一个数组，包含 {country_id, country_name, country_flag, status}
             participants_data = session_info.get('participants', [])
             
             # 直接从 participants 构造返回数据
-            data = []
-            for p in participants_data:
-                if p.get('status') == 'active':  # 只返回激活状态的参与国
-                    data.append({
-                        "id": p.get('country_id'),
-                        "name": p.get('country_name', '未知国家'),
-                        "flag_url": p.get('country_flag', '/static/flags/default.png')
-                    })
-            return jsonify({'code': 200, 'message': '获取参与国列表成功', 'data': data})
+            def build_participants():
+                data = [
+                    participant_view(p) for p in participants_data
+                    if p.get('status') == 'active'  # 只返回激活状态的参与国
+                ]
+                return jsonify({'code': 200, 'message': '获取参与国列表成功', 'data': data})
+            return etag_response(meeting_settings.etag(session_info), build_participants)
     
     # 如果不是只返回参与国，则返回所有国家（用于与会国门户选择）
-    countries = list(cols["countries"].find())
-    flag_dir = os.path.join(app.static_folder, "flags")
-
-    data = []
-    for country in countries:
-        cid = str(country.get('_id'))
-        name = country.get('country_name', '未知国家')
-
-        # 兼容你原有字段：flag / code
-        if country.get('flag'):
-            filename = os.path.basename(country['flag'])
-        elif country.get('code'):
-            filename = f"{country['code'].lower()}.png"
-        else:
-            filename = None
+    def build_countries():
+        data = [
+            {"id": country["id"], "name": country["name"], "flag_url": country["flag_url"]}
+            for country in country_index.all()
+        ]
+        return jsonify({'code': 200, 'message': '获取国家列表成功', 'data': data})
 
-        if filename and os.path.exists(os.path.join(flag_dir, filename)):
-            flag_url = f"/static/flags/{filename}"
-        else:
-            flag_url = "/static/flags/default.png"
+    return etag_response(country_index.etag(), build_countries)
 
-        data.append({"id": cid, "name": name, "flag_url": flag_url})
+@app.route('/api/countries/refresh', methods=['POST'])
+def api_refresh_countries():
+    """国家主数据变更后刷新本进程的国家索引（其他进程在 TTL 到期后自动刷新）"""
+    country_index.refresh()
+    return jsonify({'code': 200, 'message': '国家索引已刷新', 'data': country_index.stats()})
 
-    return jsonify({'code': 200, 'message': '获取国家列表成功', 'data': data})
+@app.route('/api/flags/refresh', methods=['POST'])
+def api_refresh_flags():
+    """重新扫描国旗目录，重新读取静态资源清单和雪碧图清单（替换国旗或重新构建静态资源后调用）"""
+    global flag_sprites, static_manifest
+    flag_manifest.scan()
+    static_manifest = load_static_manifest()
+    flag_sprites = load_flag_sprites()
+    return jsonify({'code': 200, 'message': '国旗清单已刷新', 'data': flag_manifest.stats()})
 
 
 # =========================
@@ -2671,7 +4270,7 @@ def api_rollcall_arrived():
     session_id = request.args.get("session_id", "default")
     
     # 首先尝试从 meeting_settings 获取参与国
-    session_info = col_settings.find_one({"session_id": session_id})
+    session_info = meeting_settings.get(session_id)
     if session_info and session_info.get('participants'):
         participants = session_info.get('participants', [])
         ids = [str(p['country_id']) for p in participants if p.get('status') == 'active']
@@ -2714,6 +4313,7 @@ def api_rollcall_update():
             upsert=True
         )
         
+        broadcast_rollcall_changes(session_id, [(country_id, arrived)])
         return jsonify({"code": 200, "message": "点名状态更新成功"})
         
     except Exception as e:
@@ -2733,59 +4333,78 @@ def api_rollcall_batch_update():
         
         cols = get_cols_by_session(session_id)
         
-        # 批量更新
-        updated_count = 0
+        # 批量更新（一次无序 bulk_write）
+        updated_at = datetime.now(UTC).isoformat() + "Z"
+        items = []
         for update in updates:
             country_id = update.get("country_id")
             arrived = update.get("arrived", False)
             
             if country_id:
-                result = cols["rollcall"].update_one(
+                items.append((
                     {"session_id": session_id, "country_id": country_id},
-                    {"$set": {
+                    {
                         "session_id": session_id,
                         "country_id": country_id,
                         "arrived": arrived, 
-                        "updated_at": datetime.now(UTC).isoformat() + "Z"
-                    }},
-                    upsert=True
-                )
-                updated_count += 1
-        return jsonify({"code": 200, "message": f"批量更新点名状态成功，共更新{updated_count}条记录"})
+                        "updated_at": updated_at
+                    }
+                ))
+
+        bulk_result = bulk_upsert(cols["rollcall"], items)
+        updated_count = len(items) - len(bulk_result["errors"])
+
+        # 写入失败的记录不推送；同一国家出现多次时以最后一条为准
+        arrivals = {}
+        for (_, doc), outcome in zip(items, bulk_result["outcomes"]):
+            if outcome != "error":
+                arrivals.pop(doc["country_id"], None)
+                arrivals[doc["country_id"]] = doc["arrived"]
+        broadcast_rollcall_changes(session_id, list(arrivals.items()))
+
+        return jsonify({
+            "code": 200,
+            "message": f"批量更新点名状态成功，共更新{updated_count}条记录",
+            "data": {
+                "counts": bulk_result["counts"],
+                "errors": bulk_result["errors"]
+            }
+        })
         
     except Exception as e:
         print(f"批量更新点名状态时出错: {str(e)}")
         return jsonify({"code": 500, "message": f"批量更新失败: {str(e)}"}), 500
 
+def rollcall_statistics(session_id):
+    """会期点名统计：应出席、已到场、未到场数量及出席率"""
+    cols = get_cols_by_session(session_id)
+    
+    # 获取应出席国家总数
+    sdoc = meeting_settings.get(session_id) or {}
+    total_countries = len(sdoc.get("participants", []))
+    
+    # 获取已出席国家数量
+    arrived_count = cols["rollcall"].count_documents({"session_id": session_id, "arrived": True})
+    
+    # 获取未出席国家数量
+    absent_count = cols["rollcall"].count_documents({"session_id": session_id, "arrived": False})
+    
+    # 计算出席率
+    attendance_rate = (arrived_count / total_countries * 100) if total_countries > 0 else 0
+    
+    return {
+        "total_countries": total_countries,
+        "arrived_count": arrived_count,
+        "absent_count": absent_count,
+        "attendance_rate": round(attendance_rate, 1)
+    }
+
 @app.route('/api/rollcall/statistics')
 def api_rollcall_statistics():
     """获取点名统计信息"""
     try:
         session_id = request.args.get("session_id", "default")
-        cols = get_cols_by_session(session_id)
-        
-        # 获取应出席国家总数
-        sdoc = cols["settings"].find_one({"session_id": session_id}) or {}
-        total_countries = len(sdoc.get("participants", []))
-        
-        # 获取已出席国家数量
-        arrived_count = cols["rollcall"].count_documents({"session_id": session_id, "arrived": True})
-        
-        # 获取未出席国家数量
-        absent_count = cols["rollcall"].count_documents({"session_id": session_id, "arrived": False})
-        
-        # 计算出席率
-        attendance_rate = (arrived_count / total_countries * 100) if total_countries > 0 else 0
-        
-        return jsonify({
-            "code": 200,
-            "data": {
-                "total_countries": total_countries,
-                "arrived_count": arrived_count,
-                "absent_count": absent_count,
-                "attendance_rate": round(attendance_rate, 1)
-            }
-        })
+        return jsonify({"code": 200, "data": rollcall_statistics(session_id)})
         
     except Exception as e:
         print(f"获取点名统计时出错: {str(e)}")
@@ -2797,7 +4416,6 @@ def api_save_meeting_settings():
     try:
         data = request.get_json()
         session_id = data.get("session_id", "default")
-        cols = get_cols_by_session(session_id)
         committee_name = data.get("committee_name", "").strip()
         agenda = data.get("agenda", "").strip()
         
@@ -2805,8 +4423,8 @@ def api_save_meeting_settings():
             return jsonify({"code": 400, "message": "会议名称和议题不能为空"}), 400
         
         # 更新或插入会议设置
-        cols["settings"].update_one(
-            {"session_id": session_id},
+        meeting_settings.update(
+            session_id,
             {
                 "$set": {
                     "committee_name": committee_name,
@@ -2829,15 +4447,14 @@ def api_save_participants():
     try:
         data = request.get_json()
         session_id = data.get("session_id", "default")
-        cols = get_cols_by_session(session_id)
         participants = data.get("participants", [])
         
         if not participants:
             return jsonify({"code": 400, "message": "应出席国家不能为空"}), 400
         
         # 更新或插入会议设置
-        cols["settings"].update_one(
-            {"session_id": session_id},
+        meeting_settings.update(
+            session_id,
             {
                 "$set": {
                     "participants": participants,
@@ -2861,29 +4478,34 @@ def api_get_session_info():
         cols = get_cols_by_session(session_id)
         
         # 获取会议设置
-        settings = cols["settings"].find_one({"session_id": session_id})
+        settings = meeting_settings.get(session_id)
         
         if settings:
-            # 获取会议状态，默认为active
-            meeting_status = "active"
+            etag = f"{meeting_settings.etag(settings)}-status-{resource_versions.tag(session_id, 'meeting_status')}"
 
-            # 检查是否有会议状态记录
-            status_record = cols["db"]["meeting_status"].find_one({"session_id": session_id})
-            if status_record:
-                meeting_status = status_record.get("status", "active")
+            def build():
+                # 获取会议状态，默认为active
+                meeting_status = "active"
 
-            return jsonify({
-                "code": 200,
-                "message": "获取会议信息成功",
-                "data": {
-                    "committee_name": settings.get("committee_name", ""),
-                    "agenda": settings.get("agenda", ""),
-                    "participants": settings.get("participants", []),
-                    "status": meeting_status,
-                    "created_at": settings.get("created_at"),
-                    "session_id": session_id
-                }
-            })
+                # 检查是否有会议状态记录
+                status_record = cols["db"]["meeting_status"].find_one({"session_id": session_id})
+                if status_record:
+                    meeting_status = status_record.get("status", "active")
+
+                return jsonify({
+                    "code": 200,
+                    "message": "获取会议信息成功",
+                    "data": {
+                        "committee_name": settings.get("committee_name", ""),
+                        "agenda": settings.get("agenda", ""),
+                        "participants": settings.get("participants", []),
+                        "status": meeting_status,
+                        "created_at": settings.get("created_at"),
+                        "session_id": session_id
+                    }
+                })
+
+            return etag_response(etag, build)
         else:
             return jsonify({
                 "code": 404,
@@ -2907,9 +4529,6 @@ def api_save_chairman():
         if not chairman_id or not chairman_name:
             return jsonify({"code": 400, "message": "主席信息不完整"}), 400
         
-        # 获取数据库集合
-        cols = get_cols_by_session(session_id)
-        
         # 保存主席信息到会议设置
         chairman_doc = {
             "session_id": session_id,
@@ -2921,8 +4540,8 @@ def api_save_chairman():
         }
         
         # 更新或插入设置
-        cols["settings"].update_one(
-            {"session_id": session_id},
+        meeting_settings.update(
+            session_id,
             {"$set": chairman_doc},
             upsert=True
         )
@@ -2950,9 +4569,6 @@ def api_save_voting_mechanism():
         if not mechanism_type or not mechanism_name or required_percentage is None:
             return jsonify({"code": 400, "message": "投票机制信息不完整"}), 400
         
-        # 获取数据库集合
-        cols = get_cols_by_session(session_id)
-        
         # 保存投票机制信息
         mechanism_doc = {
             "session_id": session_id,
@@ -2968,8 +4584,8 @@ def api_save_voting_mechanism():
         }
         
         # 更新或插入设置
-        cols["settings"].update_one(
-            {"session_id": session_id},
+        meeting_settings.update(
+            session_id,
             {"$set": mechanism_doc},
             upsert=True
         )
@@ -2987,46 +4603,36 @@ def api_get_real_time_voting_data():
         cols = get_cols_by_session(session_id)
         
         # 获取参与国家
-        settings = cols["settings"].find_one({"session_id": session_id})
+        settings = meeting_settings.get(session_id)
         if not settings or not settings.get("participants"):
             return jsonify({
                 "code": 404,
                 "message": "未找到参与国家信息"
             })
         
-        participant_ids = [str(pid) for pid in settings["participants"]]
-        countries = list(cols["countries"].find({"_id": {"$in": [ObjectId(pid) for pid in participant_ids]}}))
+        # participants 为 {country_id, ...} 数组（旧数据可能直接存 id）
+        participant_ids = [
+            str(p.get("country_id") if isinstance(p, dict) else p) for p in settings["participants"]
+        ]
         
         # 获取投票数据
         vote_details = cols["file_vote_details"].find_one({"session_id": session_id})
         votes = vote_details.get("votes", {}) if vote_details else {}
         
-        # 处理国家数据
-        flag_dir = os.path.join(app.static_folder, "flags")
+        # 处理国家数据（国家索引 + 国旗清单，不访问数据库和文件系统）
         country_data = []
         vote_data = {}
         
-        for country in countries:
-            cid = str(country.get('_id'))
-            name = country.get('country_name', '未知国家')
-            
-            # 处理国旗
-            if country.get('flag'):
-                filename = os.path.basename(country['flag'])
-            elif country.get('code'):
-                filename = f"{country['code'].lower()}.png"
-            else:
-                filename = None
-            
-            if filename and os.path.exists(os.path.join(flag_dir, filename)):
-                flag_url = f"/static/flags/{filename}"
-            else:
-                flag_url = "/static/flags/default.png"
+        for pid in participant_ids:
+            country = country_index.lookup(pid)
+            if not country:
+                continue
+            cid = country["id"]
             
             country_data.append({
                 "id": cid,
-                "name": name,
-                "flag_url": flag_url
+                "name": country["name"],
+                "flag_url": country_index.flag_url(cid)
             })
             
             # 处理投票数据（这里简化处理，实际可能需要更复杂的逻辑）
@@ -3052,17 +4658,14 @@ def api_finalize_voting():
         data = request.get_json()
         session_id = data.get("session_id", "default")
         
-        # 获取数据库集合
-        cols = get_cols_by_session(session_id)
-        
         # 这里可以添加完成投票的逻辑，比如：
         # 1. 计算最终结果
         # 2. 生成投票报告
         # 3. 更新投票状态
         
         # 简单实现：更新会议状态
-        cols["settings"].update_one(
-            {"session_id": session_id},
+        meeting_settings.update(
+            session_id,
             {"$set": {
                 "voting_completed": True,
                 "voting_completed_at": datetime.now(UTC).isoformat() + "Z"
@@ -3088,7 +4691,9 @@ def api_submissions():
     cols = get_cols_by_session(session_id)
 
     if request.method == 'GET':
-        cur = cols["submissions"].find({"session_id": session_id}).sort("created_at", -1)
+        cur = cols["submissions"].find(
+            {"session_id": session_id}, list_projection(SUBMISSION_LIST_FIELDS)
+        ).sort("created_at", -1)
         data = []
         for s in cur:
             data.append({
@@ -3332,8 +4937,7 @@ def api_save_file_vote_results():
             is_passed = agree_count > disagree_count
             
             # 获取国家信息
-            country_info = col_countries.find_one({"_id": ObjectId(assigned_country_id)})
-            country_name = country_info.get("name", "未知国家") if country_info else "未知国家"
+            country_name = country_index.name(assigned_country_id)
             
             # 保存投票结果到数据库
             vote_record = {
@@ -3416,8 +5020,7 @@ def api_get_passed_files():
                     break
             
             if assigned_country_id:
-                country_info = col_countries.find_one({"_id": ObjectId(assigned_country_id)})
-                country_name = country_info.get("name", "未知国家") if country_info else "未知国家"
+                country_name = country_index.name(assigned_country_id)
                 
                 data.append({
                     "file_id": file.get("file_id"),
@@ -3464,15 +5067,8 @@ def api_get_passed_submissions():
             for pf in passed_files:
                 country_id = pf.get("country_id", "")
                 
-                # 尝试获取国家名称
-                country_name = ""
-                if country_id:
-                    try:
-                        country = MASTER_COUNTRIES.find_one({"_id": ObjectId(country_id)})
-                        if country:
-                            country_name = country.get("name", country.get("country_name", ""))
-                    except:
-                        country_name = country_id
+                # 获取国家名称（找不到时直接显示 country_id）
+                country_name = country_index.name(country_id, str(country_id)) if country_id else ""
                 
                 data.append({
                     "country_id": str(country_id),
@@ -3498,15 +5094,7 @@ def api_get_passed_submissions():
             
             for submission in passed_submissions:
                 country_id = submission.get("country_id", "")
-                country_name = ""
-                
-                if country_id:
-                    try:
-                        country = MASTER_COUNTRIES.find_one({"_id": ObjectId(country_id)})
-                        if country:
-                            country_name = country.get("name", country.get("country_name", ""))
-                    except:
-                        country_name = str(country_id)
+                country_name = country_index.name(country_id, str(country_id)) if country_id else ""
                 
                 data.append({
                     "country_id": str(country_id),
@@ -3780,8 +5368,8 @@ def api_clear_attending_countries():
         session_id = request.args.get("session_id", "default")
 
         # 清空应出席国家列表
-        result = col_settings.update_one(
-            {"session_id": session_id},
+        result = meeting_settings.update(
+            session_id,
             {"$set": {"participants": []}},
             upsert=True
         )
@@ -3889,16 +5477,11 @@ def api_save_file_assignments():
             file_info = next((f for f in files if f.get("id") == file_id), None)
             if file_info:
                 # 获取国家信息
-                country_info = col_countries.find_one({"_id": ObjectId(country_id)})
-                country_name = country_info.get("country_name", "未知国家") if country_info else "未知国家"
+                country_info = country_index.lookup(country_id)
+                country_name = country_info["name"] if country_info else "未知国家"
                 
                 # 处理国旗文件名
-                if country_info and country_info.get('flag'):
-                    country_flag = os.path.basename(country_info['flag'])
-                elif country_info and country_info.get('code'):
-                    country_flag = f"{country_info['code'].lower()}.png"
-                else:
-                    country_flag = "default.png"
+                country_flag = (country_info and country_info["flag"]) or "default.png"
                 
                 # 获取文件的提取文本
                 temp_file = col_temp_files.find_one({"session_id": session_id, "file_id": file_id})
@@ -3943,23 +5526,29 @@ def api_get_temp_files():
     try:
         session_id = request.args.get("session_id", "default")
         
-        # 获取文件列表
-        files = list(col_temp_files.find({"session_id": session_id}))
+        # 获取文件列表（file_id 缺失时回退到 _id，因此保留 _id）
+        files = list(col_temp_files.find(
+            {"session_id": session_id},
+            list_projection(TEMP_FILE_LIST_FIELDS, include_id=True, optional=LARGE_TEXT_FIELDS)
+        ))
         
         # 获取分配信息
-        assignment_doc = col_file_assignments.find_one({"session_id": session_id})
+        assignment_doc = col_file_assignments.find_one({"session_id": session_id}, {"assignments": 1})
         assignments = assignment_doc.get("assignments", {}) if assignment_doc else {}
         
         # 格式化数据
         formatted_files = []
         for file_doc in files:
-            formatted_files.append({
+            item = {
                 "id": file_doc.get("file_id", str(file_doc["_id"])),
                 "name": file_doc.get("file_name", file_doc.get("original_name", "")),
                 "size": file_doc.get("file_size", 0),
                 "type": file_doc.get("content_type", ""),
                 "uploaded_at": file_doc.get("uploaded_at")
-            })
+            }
+            if "extracted_text" in file_doc:
+                item["extracted_text"] = file_doc["extracted_text"]
+            formatted_files.append(item)
         
         return jsonify({
             "code": 200,
@@ -4012,22 +5601,25 @@ def api_get_vote_files():
         session_id = request.args.get("session_id", "default")
         
         # 从投票文件表获取数据
-        vote_files = list(col_vote_files.find({"session_id": session_id}))
+        projection = list_projection(VOTE_FILE_LIST_FIELDS, optional=LARGE_TEXT_FIELDS)
+        vote_files = list(col_vote_files.find({"session_id": session_id}, projection))
         
-        # 格式化数据
+        # 格式化数据（extracted_text 仅在 include=extracted_text 时返回）
         data = []
         for file in vote_files:
-            data.append({
+            item = {
                 "file_id": file.get("file_id"),
                 "file_name": file.get("file_name", ""),
-                "extracted_text": file.get("extracted_text", ""),
                 "country_id": file.get("country_id"),
                 "country_name": file.get("country_name", ""),
                 "country_flag": file.get("country_flag", "default.png"),
                 "vote_status": file.get("vote_status", "pending"),
                 "vote_result": file.get("vote_result"),
                 "created_at": file.get("created_at")
-            })
+            }
+            if "extracted_text" in projection:
+                item["extracted_text"] = file.get("extracted_text", "")
+            data.append(item)
         
         return jsonify({
             "code": 200,
@@ -4087,10 +5679,12 @@ def api_save_batch_votes():
         if not votes_data:
             return jsonify({"code": 400, "message": "投票数据不能为空"}), 400
         
-        # 创建或更新投票结果集合
-        col_file_vote_details = db["file_vote_details"]
+        # 与主席监控页面读取同一会期库的投票详情集合
+        cols = get_cols_by_session(session_id)
+        col_file_vote_details = cols["file_vote_details"]
         
-        saved_count = 0
+        voted_at = datetime.now(UTC).isoformat() + "Z"
+        items = []
         for file_id, country_votes in votes_data.items():
             for country_id, vote_result in country_votes.items():
                 # 保存每个国家对每个文件的投票详情
@@ -4099,24 +5693,31 @@ def api_save_batch_votes():
                     "file_id": file_id,
                     "country_id": country_id,
                     "vote_result": vote_result,
-                    "voted_at": datetime.now(UTC).isoformat() + "Z"
+                    "voted_at": voted_at
                 }
                 
                 # 使用upsert避免重复
-                col_file_vote_details.update_one(
+                items.append((
                     {
                         "session_id": session_id,
                         "file_id": file_id,
                         "country_id": country_id
                     },
-                    {"$set": vote_detail},
-                    upsert=True
-                )
-                saved_count += 1
+                    vote_detail
+                ))
+        
+        bulk_result, change = vote_changes.write_votes(session_id, col_file_vote_details, items)
+        if change:
+            broadcast_vote_changes(session_id, change)
+        saved_count = len(items) - len(bulk_result["errors"])
         
         return jsonify({
             "code": 200,
-            "message": f"成功保存 {saved_count} 个投票记录"
+            "message": f"成功保存 {saved_count} 个投票记录",
+            "data": {
+                "counts": bulk_result["counts"],
+                "errors": bulk_result["errors"]
+            }
         })
         
     except Exception as e:
@@ -4132,28 +5733,62 @@ def api_get_file_vote_details_by_session():
         # 使用与投票提交相同的数据库连接方式
         cols = get_cols_by_session(session_id)
 
-        # 获取投票详情
-        vote_details = list(cols["db"]["file_vote_details"].find({"session_id": session_id}))
+        def build():
+            # 获取投票详情
+            vote_details = list(cols["db"]["file_vote_details"].find(
+                {"session_id": session_id}, list_projection(VOTE_DETAIL_LIST_FIELDS)
+            ))
+
+            # 转换为主席投票监控页面期望的格式：数组格式
+            formatted_votes = []
+            for detail in vote_details:
+                formatted_votes.append({
+                    "country_id": detail.get("country_id"),
+                    "file_id": detail.get("file_id"),
+                    "vote_result": detail.get("vote_result")
+                })
 
-        # 转换为主席投票监控页面期望的格式：数组格式
-        formatted_votes = []
-        for detail in vote_details:
-            formatted_votes.append({
-                "country_id": detail.get("country_id"),
-                "file_id": detail.get("file_id"),
-                "vote_result": detail.get("vote_result")
+            return jsonify({
+                "code": 200,
+                "message": "获取投票详情成功",
+                "data": formatted_votes
             })
 
-        return jsonify({
-            "code": 200,
-            "message": "获取投票详情成功",
-            "data": formatted_votes
-        })
+        return etag_response(f"file-votes-{resource_versions.tag(session_id, 'file_votes')}", build)
 
     except Exception as e:
         print(f"获取文件投票详情时出错: {str(e)}")
         return jsonify({"code": 500, "message": f"获取失败: {str(e)}"}), 500
 
+@app.route('/api/file_vote_changes', methods=['GET'])
+def api_get_file_vote_changes():
+    """投票矩阵增量同步：?since=<seq>&epoch=<epoch> 返回之后的变更；
+    未传 since、序列已被清理或 epoch 不符时返回快照（snapshot），客户端以其 seq 为新起点"""
+    try:
+        session_id = request.args.get("session_id", "default")
+        since = request.args.get("since", type=int)
+        epoch = request.args.get("epoch")
+
+        result = vote_changes.since(session_id, since, epoch)
+        if result["changes"] is not None:
+            return jsonify({"code": 200, "message": "获取投票变更成功", "data": result})
+
+        # 快照的 seq 取已落库的连续序列号，并在读取快照之前确定：不超过它的投票都已写入，
+        # 快照必然包含；快照可能已包含更新的写入，客户端随后按序重放幂等
+        result.update(vote_changes.committed(session_id))
+        cols = get_cols_by_session(session_id)
+        result["snapshot"] = [
+            {"country_id": v.get("country_id"), "file_id": v.get("file_id"), "vote_result": v.get("vote_result")}
+            for v in cols["db"]["file_vote_details"].find(
+                {"session_id": session_id}, list_projection(VOTE_DETAIL_LIST_FIELDS)
+            )
+        ]
+        return jsonify({"code": 200, "message": "获取投票快照成功", "data": result})
+
+    except Exception as e:
+        print(f"获取投票变更时出错: {str(e)}")
+        return jsonify({"code": 500, "message": f"获取失败: {str(e)}"}), 500
+
 @app.route('/api/get_file_vote_details', methods=['GET'])
 def api_get_file_vote_details():
     """获取文件投票详情（主数据库版本，向后兼容）"""
@@ -4226,7 +5861,7 @@ def get_flag(filename):
 def declaration_page():
     """共同宣言页面 / 与会国共同宣言页面"""
     session_id = request.args.get("session_id", "default")
-    sdoc = col_settings.find_one({"session_id": session_id}) or {}
+    sdoc = meeting_settings.get(session_id) or {}
     committee = sdoc.get("committee_name", " ")
     agenda = sdoc.get("agenda", " ")
 
@@ -4239,18 +5874,17 @@ def declaration_page():
 
     # 获取所有参与国家
     if sdoc.get("participants"):
-        for country_id in sdoc["participants"]:
-            country = col_countries.find_one({"_id": country_id})
+        for participant in sdoc["participants"]:
+            country_id = participant.get("country_id") if isinstance(participant, dict) else participant
+            country = country_index.lookup(country_id)
             if country:
-                total_countries.append(country.get("country_name", "未知国家"))
+                total_countries.append(country["name"])
 
     # 获取已提交的国家
     for submission in submitted_files:
-        country_id = submission.get("country_id")
-        if country_id:
-            country = col_countries.find_one({"_id": country_id})
-            if country:
-                submitted_countries.append(country.get("country_name", "未知国家"))
+        country = country_index.lookup(submission.get("country_id"))
+        if country:
+            submitted_countries.append(country["name"])
 
     return render_template(
         'declaration.html',
@@ -4321,7 +5955,7 @@ def generate_declaration():
             return jsonify({"error": "没有找到投票通过的文件，无法生成共同宣言"}), 400
         
         # 准备提交给大模型的数据(提取关键词)
-        sdoc = cols["settings"].find_one({"session_id": session_id}) or {}
+        sdoc = meeting_settings.get(session_id) or {}
         topic = sdoc.get("agenda", "未知议题")
         countries_data = []
         
@@ -4334,16 +5968,8 @@ def generate_declaration():
                 original_name = passed_file.get("original_name", file_name)
                 
                 # 获取国家信息
-                country_name = "未知国家"
-                if country_id:
-                    # 尝试从ObjectId获取
-                    try:
-                        country = MASTER_COUNTRIES.find_one({"_id": ObjectId(country_id)})
-                        if country:
-                            country_name = country.get("name", country.get("country_name", "未知国家"))
-                    except:
-                        # 如果不是ObjectId，直接使用country_id作为名称
-                        country_name = country_id
+                # 找不到时直接使用country_id作为名称
+                country_name = country_index.name(country_id, country_id) if country_id else "未知国家"
                 
                 print(f"\n🌍 处理国家: {country_name}")
                 print(f"📄 文件名: {file_name}")
@@ -4410,9 +6036,9 @@ def generate_declaration():
             for submission in submitted_files:
                 country_id = submission.get("country_id")
                 if country_id:
-                    country = MASTER_COUNTRIES.find_one({"_id": country_id})
+                    country = country_index.lookup(country_id)
                     if country:
-                        country_name = country.get("name", country.get("country_name", "未知国家"))
+                        country_name = country["name"]
                         print(f"\n🌍 处理国家: {country_name}")
                         
                         manual_text = submission.get("text", "")
@@ -4562,13 +6188,13 @@ def api_get_current_motion():
 
         if current_motion:
             # 获取动议国家的详细信息
-            country_info = cols["countries"].find_one({"id": current_motion.get("country_id", "")})
+            country_info = country_index.lookup(current_motion.get("country_id", ""))
 
             return jsonify({
                 "code": 200,
                 "message": "获取当前动议成功",
                 "data": {
-                    "country_name": country_info.get("name", "未知国家") if country_info else "未知国家",
+                    "country_name": country_info["name"] if country_info else "未知国家",
                     "country_id": current_motion.get("country_id", ""),
                     "motion_text": current_motion.get("motion_text", ""),
                     "created_at": current_motion.get("created_at"),
@@ -4610,6 +6236,7 @@ def api_update_meeting_status():
             status_record,
             upsert=True
         )
+        resource_versions.bump(session_id, "meeting_status")
 
         return jsonify({
             "code": 200,
@@ -5017,7 +6644,7 @@ def export_declaration_pdf():
             return jsonify({"error": "宣言内容不能为空"}), 400
         
         # 获取会议信息
-        sdoc = col_settings.find_one({"session_id": session_id}) or {}
+        sdoc = meeting_settings.get(session_id) or {}
         committee_name = sdoc.get("committee_name", "WTO模拟谈判")
         agenda = sdoc.get("agenda", "未指定议题")
         
@@ -5026,10 +6653,9 @@ def export_declaration_pdf():
         participating_countries = []
         for submission in submitted_files:
             country_id = submission.get("country_id")
-            if country_id:
-                country = col_countries.find_one({"_id": country_id})
-                if country:
-                    participating_countries.append(country.get("country_name", "未知国家"))
+            country = country_index.lookup(country_id)
+            if country:
+                participating_countries.append(country["name"])
         
         # 生成PDF
         pdf_buffer = generate_declaration_pdf(
@@ -5162,10 +6788,9 @@ def api_get_meeting_state():
     """获取会议当前状态和可执行操作"""
     try:
         session_id = request.args.get("session_id", "default")
-        cols = get_cols_by_session(session_id)
         
         # 获取会议设置
-        meeting = cols["settings"].find_one({"session_id": session_id})
+        meeting = meeting_settings.get(session_id)
         if not meeting:
             return jsonify({
                 "code": 404,
@@ -5229,10 +6854,8 @@ def api_advance_meeting_phase():
                 "message": "目标阶段不能为空"
             }), 400
         
-        cols = get_cols_by_session(session_id)
-        
         # 获取当前会议状态
-        meeting = cols["settings"].find_one({"session_id": session_id})
+        meeting = meeting_settings.get(session_id)
         if not meeting:
             return jsonify({
                 "code": 404,
@@ -5275,8 +6898,8 @@ def api_advance_meeting_phase():
         })
         
         # 更新数据库
-        cols["settings"].update_one(
-            {"session_id": session_id},
+        meeting_settings.update(
+            session_id,
             {
                 "$set": {
                     "meeting_state.current_phase": target_phase,
@@ -5316,11 +6939,9 @@ def api_lock_meeting_phase():
                 "message": "阶段名称不能为空"
             }), 400
         
-        cols = get_cols_by_session(session_id)
-        
         # 更新阶段锁定状态
-        cols["settings"].update_one(
-            {"session_id": session_id},
+        meeting_settings.update(
+            session_id,
             {
                 "$set": {
                     f"meeting_state.phase_locks.{phase}": locked
@@ -5351,16 +6972,18 @@ def api_get_phase_status():
         cols = get_cols_by_session(session_id)
         
         # 获取点名状态
-        rollcall_stats = cols["rollcall"].find_one({"session_id": session_id})
+        rollcall_stats = cols["rollcall"].find_one(
+            {"session_id": session_id}, {"arrived_countries": 1, "_id": 0}
+        )
         arrived_countries = rollcall_stats.get("arrived_countries", []) if rollcall_stats else []
         
         # 获取文件提交状态
-        submissions = list(cols["submissions"].find({"session_id": session_id}))
+        submissions = cols["submissions"].find({"session_id": session_id}, list_projection(("country_id",)))
         submitted_countries = [sub["country_id"] for sub in submissions]
         
-        # 获取投票状态
-        vote_details = list(cols["file_vote_details"].find({"session_id": session_id}))
-        voted_countries = list(set([vote["country_id"] for vote in vote_details]))
+        # 获取投票状态（服务端聚合统计）
+        tally = tally_votes(cols, session_id)
+        voted_countries = tally["voted_countries"]
         
         return jsonify({
             "code": 200,
@@ -5383,7 +7006,8 @@ def api_get_phase_status():
                 "voting": {
                     "completed": len(voted_countries) == len(arrived_countries) if arrived_countries else False,
                     "voted": len(voted_countries),
-                    "total": len(arrived_countries)
+                    "total": len(arrived_countries),
+                    "file_results": tally["files"]
                 }
             }
         })
@@ -5394,6 +7018,27 @@ def api_get_phase_status():
             "message": f"获取阶段状态失败: {str(e)}"
         }), 500
 
+# =========================
+# 运行指标
+# =========================
+
+@app.route('/api/metrics', methods=['GET'])
+def api_get_metrics():
+    """进程内缓存等运行指标（每个工作进程独立统计）"""
+    return jsonify({
+        "code": 200,
+        "data": {
+            "pid": os.getpid(),
+            "settings_cache": meeting_settings.stats(),
+            "mongo_pool": mongo_pool_metrics.stats(),
+            "country_index": country_index.stats(),
+            "flag_manifest": flag_manifest.stats(),
+            "json_compression": compression_metrics.stats(),
+            "presence": presence.stats(),
+            "broadcast_coalescer": broadcast_coalescer.stats()
+        }
+    })
+
 # =========================
 # Socket.io 实时通信
 # =========================
@@ -5402,13 +7047,21 @@ def api_get_phase_status():
 def handle_connect():
     """用户连接"""
     print(f"用户连接: {request.sid}")
+    presence.connect(request.sid)
     emit('connected', {'message': '连接成功'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    """用户断开连接"""
+    """用户断开连接：从所在房间的在线列表移除"""
     print(f"用户断开连接: {request.sid}")
-    # 这里可以更新用户状态为离线
+    broadcast_presence_removals(presence.disconnect(request.sid))
+
+@socketio.on('presence_heartbeat')
+def handle_presence_heartbeat(data=None):
+    """在线心跳；连接已因超时被移除时通知客户端重新加入房间"""
+    if not presence.heartbeat(request.sid):
+        emit('presence_expired', {'message': '在线状态已过期，请重新加入'})
+    sweep_presence()
 
 @socketio.on('join_room')
 def handle_join_room(data):
@@ -5424,6 +7077,10 @@ def handle_join_room(data):
         
         # 加入Socket.io房间
         join_room(room_id)
+        entry = presence.join(room_id, request.sid, user_id=user_id,
+                              country_id=data.get('country_id'), role=role)
+        broadcast_presence(room_id, joined=[entry])
+        sweep_presence()
         
         # 广播用户加入消息
         emit('user_joined', {
@@ -5435,12 +7092,29 @@ def handle_join_room(data):
         # 发送房间当前状态
         emit('room_status', {
             'room_id': room_id,
-            'message': '已加入房间'
+            'message': '已加入房间',
+            'heartbeat_interval': PRESENCE_HEARTBEAT_INTERVAL
         })
         
     except Exception as e:
         emit('error', {'message': f'加入房间失败: {str(e)}'})
 
+@socketio.on('join_session')
+def handle_join_session(data):
+    """页面订阅会期的服务端推送（投票变化等），可附带 user_id / country_id / role 用于在线列表"""
+    data = data or {}
+    session_id = data.get('session_id')
+    if not session_id:
+        emit('error', {'message': '会议ID不能为空'})
+        return
+    room = session_room(session_id)
+    join_room(room)
+    entry = presence.join(room, request.sid, user_id=data.get('user_id'),
+                          country_id=data.get('country_id'), role=data.get('role'))
+    broadcast_presence(room, joined=[entry])
+    sweep_presence()
+    emit('session_joined', {'session_id': session_id, 'heartbeat_interval': PRESENCE_HEARTBEAT_INTERVAL})
+
 @socketio.on('leave_room')
 def handle_leave_room(data):
     """用户离开房间"""
@@ -5454,6 +7128,9 @@ def handle_leave_room(data):
         
         # 离开Socket.io房间
         leave_room(room_id)
+        entry = presence.leave(room_id, request.sid)
+        if entry:
+            broadcast_presence(room_id, left=[entry])
         
         # 广播用户离开消息
         emit('user_left', {
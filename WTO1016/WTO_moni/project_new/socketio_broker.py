@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WTO会议系统 Socket.IO 本地消息代理（仅限开发和测试）
+
+运行方法：
+python socketio_broker.py                    # 监听 127.0.0.1:6390
+python socketio_broker.py --host 0.0.0.0 --port 6390
+
+多个工作进程设置 SOCKETIO_MESSAGE_QUEUE=local://<代理地址>:6390 后，任一进程的广播
+都经由本代理转发给所有进程，连接在不同进程上的页面都能收到。
+本文件同时包含工作进程一侧的 LocalBrokerManager，run.py 只在 local:// 地址时导入。
+供开发和测试使用（test_socketio_queue.py 会自动启动）；生产环境使用 Redis：
+SOCKETIO_MESSAGE_QUEUE=redis://redis:6379/0
+
+协议：客户端连接后发送一行 "PUB <频道>" 或 "SUB <频道>"，之后每条消息为
+4 字节大端长度 + 消息体。PUB 连接发来的消息原样转发给同频道的全部 SUB 连接。
+消息体为 pickle 数据且连接不做认证，代理只应监听在本机或可信的内网地址上。
+"""
+
+import argparse
+import pickle
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+from socketio import PubSubManager
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # 频道 -> {连接: 发送锁}
+        self.forwarded = 0
+
+    def subscribe(self, channel, conn):
+        with self._lock:
+            self._subscribers.setdefault(channel, {})[conn] = threading.Lock()
+
+    def unsubscribe(self, channel, conn):
+        with self._lock:
+            self._subscribers.get(channel, {}).pop(conn, None)
+
+    def publish(self, channel, frame):
+        with self._lock:
+            targets = list(self._subscribers.get(channel, {}).items())
+        for conn, send_lock in targets:
+            try:
+                with send_lock:
+                    conn.sendall(frame)
+            except OSError:
+                self.unsubscribe(channel, conn)
+        self.forwarded += 1
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline().decode('utf-8').strip()
+        role, _, channel = line.partition(' ')
+        if role not in ('PUB', 'SUB') or not channel:
+            return
+        broker = self.server.broker
+        if role == 'SUB':
+            broker.subscribe(channel, self.connection)
+            try:
+                # 订阅连接不会发送数据，读到 EOF 即表示对端断开
+                while self.rfile.read(1024):
+                    pass
+            finally:
+                broker.unsubscribe(channel, self.connection)
+            return
+
+        while True:
+            header = self.rfile.read(4)
+            if len(header) < 4:
+                return
+            size, = struct.unpack('>I', header)
+            body = self.rfile.read(size)
+            if len(body) < size:
+                return
+            broker.publish(channel, header + body)
+
+class BrokerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, BrokerHandler)
+        self.broker = Broker()
+
+class LocalBrokerManager(PubSubManager):
+    """连接 socketio_broker.py 的 Socket.IO 客户端管理器（local://host:port）。
+    协议：连接后发送一行 "PUB <频道>" 或 "SUB <频道>"，之后每条消息为
+    4 字节大端长度 + pickle 数据；代理把 PUB 连接收到的消息转发给同频道的全部 SUB 连接
+    （包括发送者自己的 SUB 连接，本进程的客户端也经由代理收到广播）。
+    """
+    name = 'localbroker'
+
+    def __init__(self, url, channel='socketio', write_only=False, logger=None):
+        address = url.split('://', 1)[1].rstrip('/')
+        host, _, port = address.rpartition(':')
+        self.address = (host or '127.0.0.1', int(port))
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _connect(self, role):
+        conn = socket.create_connection(self.address, timeout=10)
+        conn.settimeout(None)
+        conn.sendall(f"{role} {self.channel}\n".encode('utf-8'))
+        return conn
+
+    def _publish(self, data):
+        frame = pickle.dumps(data)
+        frame = struct.pack('>I', len(frame)) + frame
+        with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = self._connect('PUB')
+                    self._publisher.sendall(frame)
+                    return
+                except OSError as e:
+                    self._publisher = None
+                    if attempt:
+                        self._get_logger().error(f'无法发布到 Socket.IO 代理 {self.address}: {e}')
+
+    @staticmethod
+    def _recv_exact(conn, size):
+        buffer = b''
+        while len(buffer) < size:
+            chunk = conn.recv(size - len(buffer))
+            if not chunk:
+                raise ConnectionError('代理连接已关闭')
+            buffer += chunk
+        return buffer
+
+    def _listen(self):
+        while True:
+            try:
+                conn = self._connect('SUB')
+                while True:
+                    size, = struct.unpack('>I', self._recv_exact(conn, 4))
+                    yield self._recv_exact(conn, size)
+            except OSError as e:
+                self._get_logger().error(f'Socket.IO 代理连接中断，1 秒后重连: {e}')
+                time.sleep(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket.IO 多进程广播的本地消息代理")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址，默认 127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390, help="监听端口，默认 6390")
+    args = parser.parse_args()
+
+    with BrokerServer((args.host, args.port)) as server:
+        print(f"[OK] Socket.IO 消息代理已启动：local://{args.host}:{args.port}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
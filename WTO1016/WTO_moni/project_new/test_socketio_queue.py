@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Socket.IO 多进程广播测试脚本（手动运行，不是 pytest 用例）
+验证两个工作进程通过消息队列共享会期房间：在进程 A 上投票，连接在进程 B 上的主席端能收到推送
+
+运行方法：
+python test_socketio_queue.py                                   # 自动启动本地代理和两个工作进程
+python test_socketio_queue.py --queue redis://127.0.0.1:6379/0  # 改用已运行的 Redis
+
+代理和工作进程的输出写入临时目录下的日志文件，失败时打印各日志的末尾；
+加 --keep-logs 可在结束后保留日志目录。
+
+环境要求：
+    - MongoDB 可连接（与 run.py 相同的 .env 配置），测试会向会期 queue-test 写入一票
+    - python-socketio 客户端（requirements.txt 已包含）
+    - 端口 6390、5101、5102 未被占用（可用参数修改）
+"""
+
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+import socketio
+
+# 需要 MongoDB 和空闲端口的手动脚本，不让 pytest 收集
+__test__ = False
+
+project_root = os.path.dirname(os.path.abspath(__file__))
+
+def start_process(args, log_path, env=None):
+    """启动子进程，标准输出和错误写入 log_path"""
+    with open(log_path, "wb") as log:
+        return subprocess.Popen(
+            [sys.executable] + args, cwd=project_root, env=env,
+            stdout=log, stderr=subprocess.STDOUT
+        )
+
+def print_log_tails(log_paths, lines=20):
+    for log_path in log_paths:
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            tail = f.readlines()[-lines:]
+        print(f"----- {log_path}（最后 {len(tail)} 行）-----")
+        print("".join(tail).rstrip())
+
+def wait_for_http(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+def wait_for_port(host, port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+class SessionListener:
+    """订阅会期并记录收到的 vote_status_changed"""
+
+    def __init__(self, name, url, session_id):
+        self.name = name
+        self.votes = []
+        self.joined = threading.Event()
+        self.received = threading.Event()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on("session_joined", lambda data: self.joined.set())
+        self.sio.on("vote_status_changed", self._on_vote)
+        self.sio.connect(url, transports=["websocket"])
+        self.sio.emit("join_session", {"session_id": session_id})
+
+    def _on_vote(self, data):
+        self.votes.append(data)
+        self.received.set()
+
+def run_test(args, log_dir):
+    session_id = "queue-test"
+    worker_a = f"http://127.0.0.1:{args.port_a}"
+    worker_b = f"http://127.0.0.1:{args.port_b}"
+    processes = []
+    try:
+        queue = args.queue
+        if not queue:
+            processes.append(start_process(["socketio_broker.py", "--port", str(args.broker_port)],
+                                           os.path.join(log_dir, "broker.log")))
+            if not wait_for_port("127.0.0.1", args.broker_port):
+                print("[FAIL] 本地消息代理未能启动")
+                return False
+            queue = f"local://127.0.0.1:{args.broker_port}"
+        print(f"[INFO] 消息队列：{queue}")
+
+        env = dict(os.environ, SOCKETIO_MESSAGE_QUEUE=queue)
+        for port in (args.port_a, args.port_b):
+            processes.append(start_process(["wsgi_server.py", "--port", str(port)],
+                                           os.path.join(log_dir, f"worker-{port}.log"), env=env))
+        for url in (worker_a, worker_b):
+            if not wait_for_http(f"{url}/api/metrics"):
+                print(f"[FAIL] 工作进程 {url} 未能启动（检查 MongoDB 配置）")
+                return False
+        print(f"[OK] 工作进程 A={worker_a}，B={worker_b}")
+
+        chairman = SessionListener("主席端（进程 B）", worker_b, session_id)
+        delegate = SessionListener("与会国端（进程 A）", worker_a, session_id)
+        if not (chairman.joined.wait(10) and delegate.joined.wait(10)):
+            print("[FAIL] 订阅会期超时")
+            return False
+        print("[OK] 主席端连接进程 B，与会国端连接进程 A，均已订阅会期")
+
+        file_id = f"queue-file-{int(time.time())}"
+        response = requests.post(f"{worker_a}/api/cast_file_vote", json={
+            "session_id": session_id,
+            "country_id": "queue-country",
+            "file_id": file_id,
+            "vote_result": "agree",
+        }, timeout=10)
+        print(f"[INFO] 在进程 A 投票：HTTP {response.status_code}")
+
+        ok = True
+        for listener in (chairman, delegate):
+            if listener.received.wait(10) and any(v.get("file_id") == file_id for v in listener.votes):
+                print(f"[OK] {listener.name} 收到 vote_status_changed")
+            else:
+                print(f"[FAIL] {listener.name} 未收到 vote_status_changed")
+                ok = False
+        for listener in (chairman, delegate):
+            listener.sio.disconnect()
+        return ok
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket.IO 多进程广播测试")
+    parser.add_argument("--queue", help="已运行的消息队列地址（如 redis://...），不指定时启动本地代理")
+    parser.add_argument("--broker-port", type=int, default=6390)
+    parser.add_argument("--port-a", type=int, default=5101)
+    parser.add_argument("--port-b", type=int, default=5102)
+    parser.add_argument("--keep-logs", action="store_true", help="结束后保留代理和工作进程的日志目录")
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print("Socket.IO 多进程广播测试")
+    print("=" * 50)
+    log_dir = tempfile.mkdtemp(prefix="socketio-queue-test-")
+    ok = run_test(args, log_dir)
+    if not ok:
+        print_log_tails(sorted(os.path.join(log_dir, name) for name in os.listdir(log_dir)))
+    if args.keep_logs:
+        print(f"[INFO] 日志目录：{log_dir}")
+    else:
+        shutil.rmtree(log_dir, ignore_errors=True)
+    print("=" * 50)
+    print("[PASS] 跨进程推送正常" if ok else "[FAIL] 跨进程推送失败")
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
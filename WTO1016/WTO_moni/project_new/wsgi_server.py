@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WTO会议系统生产入口（eventlet / gevent 协程模式）
+
+运行方法：
+python wsgi_server.py                          # eventlet，监听 HOST:PORT（默认 0.0.0.0:5000）
+python wsgi_server.py --mode gevent            # gevent（需 pip install gevent gevent-websocket）
+python wsgi_server.py --port 8000 --access-log # 指定端口并输出访问日志
+
+直接运行 run.py 时使用 threading 模式和 Werkzeug 开发服务器，每个 WebSocket 连接占用一个系统线程。
+本入口在导入 run.py 之前完成 monkey-patch，socket、threading、time.sleep 以及 pymongo 连接池
+都运行在协程上，单个进程即可承载上千个与会国 WebSocket 连接。
+
+注意：
+- monkey-patch 必须先于 run.py（以及 pymongo、requests、dotenv）的导入，因此不要在其他模块中 import 本文件
+- .env 在 monkey-patch 之后才加载，协程库只能由 --mode 或进程环境变量 SOCKETIO_ASYNC_MODE 指定
+- 所有协程共享一个 MongoDB 连接池，本入口为连接池设置了上限和等待超时的默认值（可用环境变量覆盖）
+- 多进程部署时需配置 Socket.IO 消息队列，并在 Nginx 上开启会话粘滞
+"""
+
+import argparse
+import os
+import sys
+
+ASYNC_MODES = ("eventlet", "gevent")
+
+# 协程模式下的 MongoDB 连接池默认值：上千个协程共享一个连接池，
+# 限制连接数并设置等待超时，突发请求排队而不是压垮 MongoDB 或无限挂起
+GREEN_MONGO_DEFAULTS = {
+    "MONGO_MAX_POOL_SIZE": "50",
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": "5000",
+}
+
+def parse_args():
+    env_mode = os.getenv("SOCKETIO_ASYNC_MODE")
+    parser = argparse.ArgumentParser(description="以 eventlet / gevent 协程模式启动 WTO 会议系统")
+    parser.add_argument("--mode", choices=ASYNC_MODES, default=env_mode if env_mode in ASYNC_MODES else "eventlet",
+                        help="协程库，默认 eventlet（或环境变量 SOCKETIO_ASYNC_MODE）")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"), help="监听地址，默认 HOST 或 0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 5000)), help="监听端口，默认 PORT 或 5000")
+    parser.add_argument("--access-log", action="store_true", help="输出每个请求的访问日志")
+    return parser.parse_args()
+
+def monkey_patch(mode):
+    if mode == "eventlet":
+        import eventlet
+        eventlet.monkey_patch()
+    else:
+        from gevent import monkey
+        monkey.patch_all()
+
+def main():
+    mode = parse_args().mode
+    try:
+        monkey_patch(mode)
+    except ImportError:
+        print(f"[FAIL] 未安装 {mode}，请先执行 pip install {mode}"
+              f"{' gevent-websocket' if mode == 'gevent' else ''}")
+        return 1
+
+    # dotenv 导入时会创建 logging 的锁，须在 monkey-patch 之后导入；
+    # 加载 .env 后重新解析参数，使其中的 HOST / PORT 生效
+    from dotenv import load_dotenv
+    load_dotenv()
+    args = parse_args()
+    args.mode = mode
+
+    os.environ["SOCKETIO_ASYNC_MODE"] = args.mode
+    for name, value in GREEN_MONGO_DEFAULTS.items():
+        os.environ.setdefault(name, value)
+
+    from run import app, socketio
+
+    print(f"🚀 WTO模拟谈判系统（{args.mode} 模式）启动中...")
+    print(f"📍 系统接口地址：http://{args.host}:{args.port}")
+    print(f"🗄️ MongoDB 连接池：maxPoolSize={os.environ['MONGO_MAX_POOL_SIZE']}，"
+          f"waitQueueTimeoutMS={os.environ['MONGO_WAIT_QUEUE_TIMEOUT_MS']}")
+    socketio.run(app, host=args.host, port=args.port, debug=False, use_reloader=False, log_output=args.access_log)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())